@@ -0,0 +1,5 @@
+"""
+Бенчмарки слоя данных.
+
+Запускаются как модули, например: python -m benchmarks.records
+"""
@@ -0,0 +1,188 @@
+"""
+Генератор синтетических данных для бенчмарков.
+
+Размеры по умолчанию соответствуют крупному магазину; scale уменьшает
+все объемы пропорционально (например, scale=0.01 для быстрой проверки).
+Генерация детерминирована: одинаковые seed и scale дают одинаковые данные.
+
+Запуск: python -m benchmarks.data [scale] (данные пишутся во временный файл БД)
+"""
+
+import datetime
+import itertools
+import os
+import random
+import sys
+import tempfile
+import time
+import typing
+
+PRODUCTS_COUNT = 100_000
+USERS_COUNT = 10_000
+ORDER_ITEMS_COUNT = 1_000_000
+ORDER_ITEMS_PER_ORDER = 5
+CART_ITEMS_PER_USER = 3
+
+# Размер пачки записей одного INSERT ... executemany
+BATCH_SIZE = 20_000
+
+ADJECTIVES = [
+    'Большая', 'Маленькая', 'Красная', 'Синяя', 'Домашняя', 'Свежая',
+    'Говяжья', 'Куриная', 'Детская', 'Зимняя', 'Летняя', 'Прочная',
+]
+NOUNS = [
+    'банка', 'кружка', 'тушенка', 'куртка', 'лампа', 'сумка',
+    'подушка', 'книга', 'игрушка', 'тарелка', 'шапка', 'ручка',
+]
+DESCRIPTION_WORDS = [
+    'качественный', 'товар', 'доставка', 'гарантия', 'подарок', 'новинка',
+    'скидка', 'упаковка', 'хит', 'продаж', 'размер', 'цвет', 'материал',
+]
+CITIES = ['Тверь', 'Москва', 'Казань', 'Самара', 'Пермь', 'Омск']
+
+
+def use_scratch_database() -> str:
+    """
+    Направляет приложение во временный файл SQLite.
+    Вызывается до импорта models, которые читают settings.DATABASE_URL.
+    :return: путь к файлу БД.
+    """
+
+    directory = tempfile.mkdtemp(prefix='fletwb-bench-')
+    path = os.path.join(directory, 'bench.db')
+    os.environ['DATABASE_URL'] = f'sqlite:///{path}'
+
+    return path
+
+
+def get_sizes(scale: float = 1.0) -> dict[str, int]:
+    """
+    Объемы данных для коэффициента scale.
+    """
+
+    order_items = max(int(ORDER_ITEMS_COUNT * scale), ORDER_ITEMS_PER_ORDER)
+
+    return {
+        'products': max(int(PRODUCTS_COUNT * scale), 1),
+        'users': max(int(USERS_COUNT * scale), 1),
+        'orders': order_items // ORDER_ITEMS_PER_ORDER,
+        'order_items': order_items,
+    }
+
+
+def insert_batches(model: typing.Any, rows: typing.Iterable[dict[str, typing.Any]]) -> int:
+    """
+    Вставка записей пачками по BATCH_SIZE, чтобы не держать весь набор в памяти.
+    """
+
+    rows = iter(rows)
+    total = 0
+
+    while batch := list(itertools.islice(rows, BATCH_SIZE)):
+        total += model.create_many(batch)
+
+    return total
+
+
+def generate_products(generator: random.Random, count: int) -> typing.Iterator[dict[str, typing.Any]]:
+    for index in range(count):
+        yield {
+            'title': f'{generator.choice(ADJECTIVES)} {generator.choice(NOUNS)} {index}',
+            'description': ' '.join(generator.choices(DESCRIPTION_WORDS, k=8)),
+            'price': generator.randint(10_00, 10_000_00),
+            # Примерно каждый десятый товар закончился
+            'quantity_left': 0 if generator.random() < 0.1 else generator.randint(1, 500),
+        }
+
+
+def generate_users(count: int) -> typing.Iterator[dict[str, typing.Any]]:
+    for index in range(count):
+        yield {
+            'email': f'user{index}@example.com',
+            # Хэш не проверяется в бенчмарках, поэтому не вычисляется
+            'password_hash': 'benchmark',
+            'first_name': f'Имя{index}',
+            'last_name': f'Фамилия{index}',
+        }
+
+
+def generate_orders(generator: random.Random, count: int, users_count: int) -> typing.Iterator[dict[str, typing.Any]]:
+    started_at = datetime.datetime(2023, 1, 1)
+
+    for _ in range(count):
+        yield {
+            'user_id': generator.randint(1, users_count),
+            'total_price': 0,
+            'date_created': started_at + datetime.timedelta(minutes=generator.randint(0, 500_000)),
+            'delivery_address': generator.choice(CITIES),
+        }
+
+
+def generate_order_items(
+        generator: random.Random,
+        orders_count: int,
+        products_count: int
+) -> typing.Iterator[dict[str, typing.Any]]:
+    for order_id in range(1, orders_count + 1):
+        for _ in range(ORDER_ITEMS_PER_ORDER):
+            yield {
+                'order_id': order_id,
+                'product_id': generator.randint(1, products_count),
+                'quantity': generator.randint(1, 5),
+            }
+
+
+def generate_cart_items(
+        generator: random.Random,
+        users_count: int,
+        products_count: int
+) -> typing.Iterator[dict[str, typing.Any]]:
+    for user_id in range(1, users_count + 1):
+        product_ids = generator.sample(range(1, products_count + 1), min(CART_ITEMS_PER_USER, products_count))
+
+        for product_id in product_ids:
+            yield {
+                'user_id': user_id,
+                'product_id': product_id,
+                'quantity': generator.randint(1, 3),
+            }
+
+
+def generate(scale: float = 1.0, seed: int = 0) -> dict[str, int]:
+    """
+    Заполняет пустую БД (settings.DATABASE_URL) синтетическими данными.
+    :param scale: коэффициент объема данных.
+    :param seed: начальное значение генератора случайных чисел.
+    :return: кол-во созданных записей по таблицам.
+    """
+
+    from models import sqlalchemy
+
+    sqlalchemy.init_db()
+
+    generator = random.Random(seed)
+    sizes = get_sizes(scale)
+
+    return {
+        'products': insert_batches(sqlalchemy.Product, generate_products(generator, sizes['products'])),
+        'users': insert_batches(sqlalchemy.User, generate_users(sizes['users'])),
+        'orders': insert_batches(
+            sqlalchemy.Order,
+            generate_orders(generator, sizes['orders'], sizes['users'])
+        ),
+        'order_items': insert_batches(
+            sqlalchemy.OrderItem,
+            generate_order_items(generator, sizes['orders'], sizes['products'])
+        ),
+        'cart_items': insert_batches(
+            sqlalchemy.CartItem,
+            generate_cart_items(generator, sizes['users'], sizes['products'])
+        ),
+    }
+
+
+if __name__ == '__main__':
+    print(use_scratch_database())
+    started = time.perf_counter()
+    print(generate(float(sys.argv[1]) if len(sys.argv) > 1 else 1.0))
+    print(f'{time.perf_counter() - started:.1f} s')
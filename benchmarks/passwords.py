@@ -0,0 +1,90 @@
+"""
+Подбор параметров хэширования паролей под целевое время на текущем железе.
+
+Для scrypt n удваивается, пока одно вычисление не займет target мс;
+для PBKDF2 кол-во итераций пересчитывается из замеренной скорости.
+Печатает переменные окружения для settings.
+
+Запуск: python -m benchmarks.passwords [target_ms]
+"""
+
+import concurrent.futures
+import statistics
+import sys
+import time
+import passwords
+import settings
+
+TARGET_MS = 250
+REPEAT = 3
+PASSWORD = 'correct horse battery staple'
+
+
+def measure(hasher: passwords.Hasher, repeat: int = REPEAT) -> float:
+    """
+    Медианное время создания хэша, мс.
+    """
+
+    timings = []
+
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        hasher.encode(PASSWORD)
+        timings.append(time.perf_counter() - started_at)
+
+    return statistics.median(timings) * 1000
+
+
+def calibrate_scrypt(target_ms: float) -> [passwords.ScryptHasher, float]:
+    n = 2 ** 12
+
+    while True:
+        hasher = passwords.ScryptHasher(n=n, r=settings.PASSWORD_SCRYPT_R, p=settings.PASSWORD_SCRYPT_P)
+        elapsed = measure(hasher)
+
+        if elapsed >= target_ms or n >= 2 ** 20:
+            return hasher, elapsed
+
+        n *= 2
+
+
+def calibrate_pbkdf2(target_ms: float) -> [passwords.PBKDF2Hasher, float]:
+    probe = passwords.PBKDF2Hasher(iterations=100_000)
+    iterations = int(probe.iterations * target_ms / measure(probe))
+    # Округление до тысяч итераций
+    hasher = passwords.PBKDF2Hasher(iterations=max(round(iterations, -3), 1000))
+
+    return hasher, measure(hasher)
+
+
+def measure_throughput(hasher: passwords.Hasher, workers: int, count: int = 8) -> float:
+    """
+    Кол-во хэшей в секунду в пуле из workers потоков.
+    """
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        started_at = time.perf_counter()
+        list(executor.map(hasher.encode, [PASSWORD] * count))
+
+    return count / (time.perf_counter() - started_at)
+
+
+def main(target_ms: float = TARGET_MS):
+    scrypt, scrypt_ms = calibrate_scrypt(target_ms)
+    pbkdf2, pbkdf2_ms = calibrate_pbkdf2(target_ms)
+
+    print(f'scrypt: {scrypt.get_parameters()} - {scrypt_ms:.0f} мс, {128 * scrypt.n * scrypt.r / 1024 / 1024:.0f} МБ')
+    print(f'pbkdf2_sha256: {pbkdf2.iterations} итераций - {pbkdf2_ms:.0f} мс')
+
+    for workers in (1, settings.PASSWORD_HASHING_WORKERS):
+        print(f'scrypt, потоков {workers}: {measure_throughput(scrypt, workers):.1f} хэшей/с')
+
+    print()
+    print(f'PASSWORD_SCRYPT_N={scrypt.n}')
+    print(f'PASSWORD_PBKDF2_ITERATIONS={pbkdf2.iterations}')
+
+    return {'scrypt': scrypt, 'pbkdf2_sha256': pbkdf2}
+
+
+if __name__ == '__main__':
+    main(float(sys.argv[1]) if len(sys.argv) > 1 else TARGET_MS)
@@ -0,0 +1,64 @@
+"""
+Сравнение памяти, удерживаемой выборкой товаров, в обычном режиме
+(AttriDict-копии ORM-объектов) и в быстром режиме (fast=True).
+
+Запуск: python -m benchmarks.records [кол-во товаров]
+"""
+
+import gc
+import sys
+import time
+import tracemalloc
+from benchmarks import data
+
+PRODUCTS_COUNT = 100_000
+
+
+def measure(fetch) -> dict:
+    gc.collect()
+    tracemalloc.start()
+    started_at = time.perf_counter()
+
+    rows = fetch()
+
+    elapsed = time.perf_counter() - started_at
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'rows': len(rows),
+        'seconds': round(elapsed, 3),
+        'retained_mb': round(retained / 1024 / 1024, 2),
+        'peak_mb': round(peak / 1024 / 1024, 2),
+    }
+
+
+def main(products_count: int = PRODUCTS_COUNT):
+    data.use_scratch_database()
+
+    from models import sqlalchemy
+
+    sqlalchemy.init_db()
+    sqlalchemy.Product.create_many(
+        {
+            'title': f'Товар {index}',
+            'description': f'Описание товара {index}',
+            'price': index % 100_000,
+            'quantity_left': index % 50,
+        }
+        for index in range(products_count)
+    )
+
+    results = {
+        'as_dict': measure(lambda: sqlalchemy.Product.fetch_all()),
+        'fast': measure(lambda: sqlalchemy.Product.fetch_all(fast=True)),
+    }
+
+    for name, result in results.items():
+        print(f'{name:>8}: {result}')
+
+    return results
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else PRODUCTS_COUNT)
@@ -0,0 +1,223 @@
+"""
+Набор бенчмарков слоя данных и страниц на синтетических данных.
+
+Результаты сохраняются в JSON; при передаче --baseline с результатами
+предыдущего запуска печатается сравнение, а замедление любого бенчмарка
+больше чем на --threshold завершает процесс с кодом 1.
+
+Запуск: python -m benchmarks.suite [--scale 0.1] [--output results.json] [--baseline old.json]
+"""
+
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import typing
+from benchmarks import data
+
+REPEAT = 20
+
+
+class Benchmark:
+    """
+    Измерение одной операции: минимум, медиана и среднее по повторам,
+    а также кол-во SQL-запросов на один вызов.
+    """
+
+    def __init__(self, name: str, function: typing.Callable[[], typing.Any], setup: typing.Callable[[], typing.Any] = None):
+        self.name = name
+        self.function = function
+        self.setup = setup
+
+    def run(self, repeat: int = REPEAT) -> dict[str, typing.Any]:
+        from models import instrumentation
+
+        timings = []
+
+        for _ in range(repeat):
+            if self.setup:
+                self.setup()
+
+            with instrumentation.track(f'benchmark {self.name}') as invocation:
+                started_at = time.perf_counter()
+                self.function()
+                timings.append(time.perf_counter() - started_at)
+
+        return {
+            'min_ms': round(min(timings) * 1000, 3),
+            'median_ms': round(statistics.median(timings) * 1000, 3),
+            'mean_ms': round(statistics.mean(timings) * 1000, 3),
+            'queries': invocation.queries,
+            'repeat': repeat,
+        }
+
+
+def build_page(control: typing.Any) -> int:
+    """
+    Строит дерево элементов страницы так же, как page.add(), без сервера Flet.
+    :return: кол-во элементов в дереве.
+    """
+
+    return len(control._build_add_commands())
+
+
+def get_benchmarks(sizes: dict[str, int]) -> list[Benchmark]:
+    import pages
+    import router
+    from models import sqlalchemy
+    from services import cart
+
+    # Пользователь с заказами, чтобы профиль строился не пустым
+    user = sqlalchemy.User.fetch_one(id=sqlalchemy.Order.fetch_one(id=1).user_id)
+    user_control = router.UserControl()
+    user_control.set_user(user)
+
+    products_count = sizes['products']
+    counter = iter(range(10 ** 9))
+    # Один цикл событий на все вызовы: соединения async-пула привязаны к нему
+    loop = asyncio.new_event_loop()
+
+    def clear_product_cache():
+        sqlalchemy.Product.result_cache.clear()
+
+    def update_cart_item():
+        cart_item = sqlalchemy.CartItem.fetch_one(user_id=user.id)
+        sqlalchemy.CartItem.update(cart_item.id, quantity=cart_item.quantity % 5 + 1)
+
+    return [
+        Benchmark(
+            'fetch_all_in_stock',
+            lambda: sqlalchemy.Product.fetch_all(quantity_left__gt=0),
+            clear_product_cache,
+        ),
+        Benchmark(
+            'fetch_all_in_stock_fast',
+            lambda: sqlalchemy.Product.fetch_all(quantity_left__gt=0, fast=True),
+            clear_product_cache,
+        ),
+        Benchmark(
+            'fetch_page_in_stock',
+            lambda: sqlalchemy.Product.fetch_page(limit=20, fast=True, quantity_left__gt=0),
+            clear_product_cache,
+        ),
+        Benchmark(
+            'fetch_page_in_stock_cached',
+            lambda: sqlalchemy.Product.fetch_page(limit=20, fast=True, quantity_left__gt=0),
+        ),
+        Benchmark(
+            'create_product',
+            lambda: sqlalchemy.Product.create(
+                title=f'Новый товар {next(counter)}',
+                description='Описание',
+                price=100_00,
+                quantity_left=10,
+            ),
+        ),
+        Benchmark(
+            'cart_add',
+            lambda: cart.add_to_cart(user.id, next(counter) % products_count + 1),
+        ),
+        Benchmark('cart_update', update_cart_item),
+        Benchmark(
+            'cart_add_async',
+            lambda: loop.run_until_complete(cart.aadd_to_cart(user.id, next(counter) % products_count + 1)),
+        ),
+        Benchmark('order_history', lambda: sqlalchemy.Order.fetch_history(user.id)),
+        Benchmark(
+            'search',
+            lambda: sqlalchemy.Product.search('красная банка', limit=20, fast=True, quantity_left__gt=0),
+            clear_product_cache,
+        ),
+        Benchmark(
+            'page_index',
+            lambda: build_page(pages.Index(None, user_control)),
+            clear_product_cache,
+        ),
+        Benchmark('page_profile', lambda: build_page(pages.Profile(None, user_control))),
+    ]
+
+
+def compare(results: dict[str, typing.Any], baseline: dict[str, typing.Any], threshold: float) -> list[str]:
+    """
+    Сравнение медиан с предыдущим запуском.
+    :return: имена бенчмарков, замедлившихся больше чем на threshold.
+    """
+
+    regressions = []
+
+    for name, result in results['benchmarks'].items():
+        previous = baseline['benchmarks'].get(name)
+        if not previous:
+            continue
+
+        ratio = result['median_ms'] / previous['median_ms'] if previous['median_ms'] else 1.0
+        marker = ''
+
+        if ratio > 1 + threshold:
+            regressions.append(name)
+            marker = '  <-- регрессия'
+
+        print(f'{name:>28}: {previous["median_ms"]:>10.3f} -> {result["median_ms"]:>10.3f} ms (x{ratio:.2f}){marker}')
+
+    return regressions
+
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', type=float, default=1.0, help='коэффициент объема данных')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=REPEAT)
+    parser.add_argument('--output', default=None, help='файл результатов (по умолчанию - рядом с временной БД)')
+    parser.add_argument('--baseline', default=None, help='JSON предыдущего запуска для сравнения')
+    parser.add_argument('--threshold', type=float, default=0.25, help='допустимое замедление, доля')
+    arguments = parser.parse_args(argv)
+
+    database_path = data.use_scratch_database()
+    output_path = arguments.output or os.path.join(os.path.dirname(database_path), 'benchmark-results.json')
+
+    import sqlalchemy
+
+    started_at = time.perf_counter()
+    sizes = data.generate(arguments.scale, arguments.seed)
+    print(f'Данные: {sizes} за {time.perf_counter() - started_at:.1f} с ({database_path})')
+
+    results = {
+        'created_at': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'sqlalchemy': sqlalchemy.__version__,
+        'platform': platform.platform(),
+        'scale': arguments.scale,
+        'seed': arguments.seed,
+        'sizes': sizes,
+        'benchmarks': {},
+    }
+
+    for benchmark in get_benchmarks(sizes):
+        result = benchmark.run(arguments.repeat)
+        results['benchmarks'][benchmark.name] = result
+        print(f'{benchmark.name:>28}: {result}')
+
+    with open(output_path, 'w', encoding='utf-8') as file:
+        json.dump(results, file, ensure_ascii=False, indent=2)
+
+    print(f'Результаты: {output_path}')
+
+    if not arguments.baseline:
+        return 0
+
+    with open(arguments.baseline, encoding='utf-8') as file:
+        baseline = json.load(file)
+
+    if baseline.get('scale') != arguments.scale:
+        print('Внимание: базовый запуск выполнен с другим scale, сравнение некорректно.')
+
+    return 1 if compare(results, baseline, arguments.threshold) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
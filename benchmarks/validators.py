@@ -0,0 +1,81 @@
+"""
+Пропускная способность валидации моделей pydantic на синтетических данных:
+проверка эл.почты сырым шаблоном и заранее скомпилированным, валидация
+товаров по одной записи и пакетом через TypeAdapter, а также преобразование
+записей выборки fast=True в ProductModel: from_rows() и model_construct().
+
+Запуск: python -m benchmarks.validators [кол-во записей]
+"""
+
+import random
+import re
+import statistics
+import sys
+import time
+import typing
+from benchmarks import data
+
+RECORDS_COUNT = 10_000
+REPEAT = 5
+
+
+def measure(function: typing.Callable[[], typing.Any], count: int, repeat: int = REPEAT) -> dict[str, float]:
+    """
+    Медианное время на одну запись, мкс, и кол-во записей в секунду.
+    """
+
+    timings = []
+
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started_at)
+
+    elapsed = statistics.median(timings)
+
+    return {
+        'us_per_record': round(elapsed / count * 1_000_000, 3),
+        'records_per_second': round(count / elapsed),
+    }
+
+
+def main(count: int = RECORDS_COUNT) -> dict[str, dict[str, float]]:
+    from models import pydantic, sqlalchemy, validators
+
+    generator = random.Random(0)
+    products = [
+        {'id': index, **product}
+        for index, product in enumerate(data.generate_products(generator, count), start=1)
+    ]
+    records = [sqlalchemy.Product.get_record_type()(**{'logo': None, **product}) for product in products]
+    emails = [user['email'] for user in data.generate_users(count)]
+
+    results = {
+        'email_raw_pattern': measure(
+            lambda: [re.match(validators.EMAIL_PATTERN.pattern, email) for email in emails],
+            count,
+        ),
+        'email_compiled_pattern': measure(
+            lambda: [validators.EMAIL_PATTERN.match(email) for email in emails],
+            count,
+        ),
+        'product_model_validate': measure(
+            lambda: [pydantic.ProductModel.model_validate(product) for product in products],
+            count,
+        ),
+        'product_type_adapter': measure(lambda: pydantic.validate_products(products), count),
+        'product_from_records': measure(lambda: pydantic.from_rows(pydantic.ProductModel, records), count),
+        'product_model_construct': measure(
+            lambda: [pydantic.ProductModel.model_construct(**record._asdict()) for record in records],
+            count,
+        ),
+    }
+
+    for name, result in results.items():
+        print(f'{name:>28}: {result["us_per_record"]:>8.3f} мкс/запись, {result["records_per_second"]:>10} записей/с')
+
+    return results
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else RECORDS_COUNT)
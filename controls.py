@@ -1,5 +1,7 @@
+import asyncio
 import dataclasses
 import datetime
+import inspect
 import os.path
 import random
 import typing
@@ -10,20 +12,13 @@ import pydantic_core
 import qrcode
 from jinja2 import Template
 import settings
-from models import sqlalchemy, pydantic
+from models import sqlalchemy, pydantic, instrumentation
 from io import BytesIO
 import pdfkit
 
 
-@dataclasses.dataclass
-class Product:
-    id: int
-    title: str
-    description: str
-    price: int
-    quantity_left: int
-    logo: str = None
-    images: list[str] = None
+# Товар в виджетах - модель pydantic, см. pydantic.from_rows()
+Product = pydantic.ProductModel
 
 
 @dataclasses.dataclass
@@ -34,6 +29,27 @@ class CartItem:
     user: sqlalchemy.User
 
 
+async def call_handler(handler: typing.Callable, *args: typing.Any) -> typing.Any:
+    """
+    Вызов обработчика события из асинхронного обработчика виджета.
+    Корутины ожидаются в цикле событий, синхронные функции выполняются
+    в отдельном потоке, чтобы не блокировать цикл событий.
+    :param handler: обработчик (может быть None).
+    :param args: аргументы обработчика.
+    :return: результат обработчика.
+    """
+
+    if not handler:
+        return None
+
+    with instrumentation.track(handler.__qualname__.replace('.<locals>', '')):
+        if inspect.iscoroutinefunction(handler):
+            return await handler(*args)
+
+        # to_thread() копирует контекст, запросы в потоке учитываются по обработчику
+        return await asyncio.to_thread(handler, *args)
+
+
 class ProductCard(ft.UserControl):
     """
     Виджет карточки товара
@@ -53,9 +69,18 @@ class ProductCard(ft.UserControl):
         self.__on_buy_now_click = on_buy_now_click
         self.__on_click = on_click
 
+    async def handle_click(self, _):
+        await call_handler(self.__on_click, self.__product)
+
+    async def handle_add_to_cart_click(self, _):
+        await call_handler(self.__on_add_to_card_click, self.__product)
+
+    async def handle_buy_now_click(self, _):
+        await call_handler(self.__on_buy_now_click or self.__on_add_to_card_click, self.__product)
+
     def build(self):
         return ft.Container(
-            on_click=lambda *_: self.__on_click and self.__on_click(self.__product),
+            on_click=self.handle_click,
             expand=True,
             col={'sm': 6, 'xs': 4},
             content=ft.Column(
@@ -89,7 +114,8 @@ class ProductCard(ft.UserControl):
                         [
                             ft.Row([
                                 ft.Text(
-                                    f'{self.__product.price / 100} RUB',
+                                    f'{self.__product.price / 100} RUB'
+                                    if self.__product.price is not None else 'Цена не указана',
                                     size=18,
                                     max_lines=1
                                 )
@@ -97,11 +123,11 @@ class ProductCard(ft.UserControl):
                             ft.Row([
                                 ft.IconButton(
                                     icon=ft.icons.ADD_SHOPPING_CART,
-                                    on_click=lambda *_: self.__on_add_to_card_click(self.__product),
+                                    on_click=self.handle_add_to_cart_click,
                                 ),
                                 ft.IconButton(
                                     icon=ft.icons.CURRENCY_RUBLE_OUTLINED,
-                                    on_click=lambda *_: self.__on_add_to_card_click(self.__product),
+                                    on_click=self.handle_buy_now_click,
                                 )
                             ]),
                         ],
@@ -122,17 +148,27 @@ class ProductList(ft.UserControl):
 
     def __init__(
             self,
-            products: list[Product],
+            products: list[Product] = None,
             on_add_to_cart_click: typing.Callable[[Product], typing.Any] = None,
             on_buy_now_click: typing.Callable[[Product], typing.Any] = None,
             on_product_click: typing.Callable[[Product], typing.Any] = None,
             products_per_page: int = 10,
+            fetch_page: typing.Callable[[typing.Any, int], [list[Product], typing.Any]] = None,
             **kwargs
     ):
+        """
+        :param products: готовый список товаров.
+        :param fetch_page: функция (курсор, размер страницы) -> (товары, следующий курсор),
+            при ее указании товары подгружаются из БД постранично по кнопке "Загрузить еще".
+        """
+
         super().__init__(**kwargs)
 
         self.__page = 0
-        self.__products = products
+        self.__products = products or []
+        self.__fetch_page = fetch_page
+        self.__cursor = None
+        self.__has_more_pages = fetch_page is not None
         self.__on_add_to_card_click = on_add_to_cart_click
         self.__on_buy_now_click = on_buy_now_click
         self.__on_product_click = on_product_click
@@ -144,6 +180,9 @@ class ProductList(ft.UserControl):
             run_spacing=10,
         )
 
+        if self.__fetch_page:
+            self.get_elements_for_page(self.__page)
+
     def handle_go_to_next_page(self, _):
         self.__page += 1
 
@@ -195,9 +234,23 @@ class ProductList(ft.UserControl):
 
         return self.row
 
+    def load_next_page(self):
+        products, self.__cursor = self.__fetch_page(self.__cursor, self.__products_per_page)
+
+        self.__products.extend(products)
+        self.__has_more_pages = self.__cursor is not None
+
     def get_elements_for_page(self, page: int) -> [list, bool]:
-        products_sliced = self.__products[0:self.__products_per_page * (page + 1)]
-        return products_sliced, len(self.__products) > len(products_sliced)
+        products_required = self.__products_per_page * (page + 1)
+
+        while self.__fetch_page and self.__has_more_pages and len(self.__products) < products_required:
+            self.load_next_page()
+
+        products_sliced = self.__products[0:products_required]
+        has_next_page = len(self.__products) > len(products_sliced) or (
+            self.__fetch_page is not None and self.__has_more_pages
+        )
+        return products_sliced, has_next_page
 
     @property
     def products(self):
@@ -206,8 +259,27 @@ class ProductList(ft.UserControl):
     @products.setter
     def products(self, value: list[Product]):
         self.__products = value.copy()
+        self.__fetch_page = None
+        self.__has_more_pages = False
         self.__page = 0
 
+        self.render_page()
+
+    @property
+    def fetch_page(self):
+        return self.__fetch_page
+
+    @fetch_page.setter
+    def fetch_page(self, value: typing.Callable[[typing.Any, int], [list[Product], typing.Any]]):
+        self.__products = []
+        self.__fetch_page = value
+        self.__cursor = None
+        self.__has_more_pages = True
+        self.__page = 0
+
+        self.render_page()
+
+    def render_page(self):
         products, has_next_page = self.get_elements_for_page(self.__page)
 
         self.row.controls = [
@@ -326,13 +398,12 @@ class FletForm(ft.UserControl):
             e.control.error_text = ''
             self.update()
 
-    def handle_form_submit(self, _):
+    async def handle_form_submit(self, _):
         try:
             self.clear_field_errors()
             self.__model.model_validate(self.__values)
 
-            if self.__handle_form_submit:
-                return self.__handle_form_submit(self.__values.copy())
+            return await call_handler(self.__handle_form_submit, self.__values.copy())
         except pd.ValidationError as validation_error:
             self.handle_field_errors(validation_error)
 
@@ -408,11 +479,13 @@ class ShoppingCartCanvas(ft.NavigationDrawer):
             cart_items: list[sqlalchemy.CartItem],
             on_quantity_change: typing.Callable[[sqlalchemy.CartItem, int], typing.Any] = None,
             on_item_delete: typing.Callable[[sqlalchemy.CartItem], typing.Any] = None,
+            on_checkout: typing.Callable[[list[sqlalchemy.CartItem]], typing.Any] = None,
             **kwargs,
     ):
         self.__cart_items = cart_items
         self.__on_quantity_change = on_quantity_change
         self.__on_item_delete = on_item_delete
+        self.__on_checkout = on_checkout
         self.drawer_heading = [
             ft.Row(
                 controls=[
@@ -463,6 +536,22 @@ class ShoppingCartCanvas(ft.NavigationDrawer):
         if self.__on_item_delete:
             self.__on_item_delete(cart_item)
 
+    def handle_checkout(self, _):
+        if self.__on_checkout:
+            self.__on_checkout(self.cart_items)
+
+    def render_checkout_button(self):
+        return ft.Row(
+            controls=[
+                ft.ElevatedButton(
+                    'Оформить заказ',
+                    icon=ft.icons.SHOPPING_CART_CHECKOUT_ROUNDED,
+                    on_click=self.handle_checkout,
+                )
+            ],
+            alignment=ft.MainAxisAlignment.CENTER
+        )
+
     def render_cart_items(self, cart_items: list[CartItem]):
         return [
             ft.Row(
@@ -539,6 +628,8 @@ class ShoppingCartCanvas(ft.NavigationDrawer):
                     alignment=ft.MainAxisAlignment.CENTER
                 )
             )
+        elif self.__on_checkout:
+            self.controls.append(self.render_checkout_button())
 
         self.update()
 
@@ -563,6 +654,8 @@ class ShoppingCartCanvas(ft.NavigationDrawer):
                     alignment=ft.MainAxisAlignment.CENTER
                 )
             )
+        elif self.__on_checkout:
+            self.controls.append(self.render_checkout_button())
 
         return super().build()
 
@@ -580,12 +673,14 @@ class OrderCard(ft.UserControl):
             self,
             order: sqlalchemy.Order,
             order_items: list[sqlalchemy.OrderItem],
+            total_quantity: int = None,
             **kwargs
     ):
         super().__init__(**kwargs)
 
         self.__order = order
         self.__order_items = order_items
+        self.__total_quantity = total_quantity
         self.__default_image_path = 'https://avatars.mds.yandex.net/get-mpic/5253116/2a0000018aa507311f34ae5b644286e1650d/orig'
 
     def generate_qr_code(self):
@@ -597,6 +692,9 @@ class OrderCard(ft.UserControl):
         return base64.b64encode(buffer.getvalue()).decode("utf-8")
 
     def get_total_quantity(self):
+        if self.__total_quantity is not None:
+            return self.__total_quantity
+
         return sum([item.quantity for item in self.__order_items])
 
     def download_request(self, _):
@@ -1,4 +1,5 @@
 import flet as ft
+from models.sqlalchemy import init_db
 from router import Router
 
 
@@ -24,4 +25,5 @@ def main(page: ft.Page):
 
 
 if __name__ == '__main__':
+    init_db()
     ft.app(target=main)
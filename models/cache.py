@@ -0,0 +1,170 @@
+import collections
+import threading
+import time
+import typing
+import sqlalchemy
+import sqlalchemy.orm
+
+# Кэши результатов по именам таблиц, данные которых они хранят
+_table_caches = collections.defaultdict(list)
+
+# Признак отсутствия значения в кэше (None - допустимое значение)
+MISSING = object()
+
+
+class ResultCache:
+    """
+    Ограниченный по размеру (LRU) и времени жизни записей (TTL) кэш
+    результатов выборок.
+
+    Кэш сбрасывается при любом INSERT/UPDATE/DELETE в таблицы tables,
+    выполненном через сессию SQLAlchemy (см. invalidate_tables()).
+    Чтобы выборка, начатая до сброса, не положила в кэш устаревшие
+    данные, значение сохраняется только если с начала выборки кэш
+    не сбрасывался (см. generation).
+    """
+
+    def __init__(self, tables: typing.Iterable[str], max_size: int = 1024, ttl: float = 60):
+        self.__max_size = max_size
+        self.__ttl = ttl
+        self.__values = collections.OrderedDict()
+        self.__lock = threading.Lock()
+
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+        for table in tables:
+            _table_caches[table].append(self)
+
+    def get(self, key: typing.Hashable, default: typing.Any = None) -> typing.Any:
+        with self.__lock:
+            item = self.__values.get(key)
+
+            if item is not None and item[0] > time.monotonic():
+                self.__values.move_to_end(key)
+                self.hits += 1
+                return item[1]
+
+            if item is not None:
+                del self.__values[key]
+                self.evictions += 1
+
+            self.misses += 1
+            return default
+
+    def set(self, key: typing.Hashable, value: typing.Any, generation: int = None) -> None:
+        with self.__lock:
+            if generation is not None and generation != self.generation:
+                return
+
+            self.__values[key] = (time.monotonic() + self.__ttl, value)
+            self.__values.move_to_end(key)
+
+            if len(self.__values) > self.__max_size:
+                self.__values.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_load(self, key: typing.Hashable, loader: typing.Callable[[], typing.Any]) -> typing.Any:
+        """
+        Значение из кэша, либо результат loader(), который сохраняется в кэш.
+        :param key: ключ (None - не кэшировать).
+        :param loader: функция загрузки значения.
+        """
+
+        if key is None:
+            return loader()
+
+        value = self.get(key, MISSING)
+        if value is not MISSING:
+            return value
+
+        generation = self.generation
+        value = loader()
+        self.set(key, value, generation)
+
+        return value
+
+    def invalidate(self) -> None:
+        with self.__lock:
+            self.__values.clear()
+            self.generation += 1
+            self.invalidations += 1
+
+    def stats(self) -> dict[str, typing.Any]:
+        requests = self.hits + self.misses
+
+        return {
+            'size': len(self.__values),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / requests if requests else 0.0,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+        }
+
+    def clear(self) -> None:
+        self.invalidate()
+
+        with self.__lock:
+            self.hits = self.misses = self.evictions = self.invalidations = 0
+
+
+def invalidate_tables(tables: typing.Iterable[str]) -> None:
+    """
+    Сбрасывает кэши, хранящие данные указанных таблиц.
+    """
+
+    for table in set(tables):
+        for cache in _table_caches.get(table, ()):
+            cache.invalidate()
+
+
+def get_changed_table(statement: typing.Any) -> typing.Optional[str]:
+    description = getattr(statement, 'entity_description', None)
+    if not description or description.get('table') is None:
+        return None
+
+    return description['table'].name
+
+
+@sqlalchemy.event.listens_for(sqlalchemy.orm.Session, 'do_orm_execute')
+def track_changed_tables(orm_execute_state: sqlalchemy.orm.ORMExecuteState) -> None:
+    """
+    Сбрасывает кэши таблиц, изменяемых запросом, сразу и еще раз после
+    фиксации или отката транзакции: до фиксации другие потоки еще могут
+    прочитать и закэшировать старые данные.
+    """
+
+    if not (orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+
+    table = get_changed_table(orm_execute_state.statement)
+    if table is None or table not in _table_caches:
+        return
+
+    invalidate_tables([table])
+    orm_execute_state.session.info.setdefault('changed_tables', set()).add(table)
+
+
+@sqlalchemy.event.listens_for(sqlalchemy.orm.Session, 'after_flush')
+def track_flushed_tables(session: sqlalchemy.orm.Session, _) -> None:
+    tables = {
+        instance.__table__.name
+        for instance in (*session.new, *session.dirty, *session.deleted)
+    }.intersection(_table_caches)
+
+    if tables:
+        invalidate_tables(tables)
+        session.info.setdefault('changed_tables', set()).update(tables)
+
+
+@sqlalchemy.event.listens_for(sqlalchemy.orm.Session, 'after_commit')
+@sqlalchemy.event.listens_for(sqlalchemy.orm.Session, 'after_rollback')
+def invalidate_changed_tables(session: sqlalchemy.orm.Session) -> None:
+    changed_tables = session.info.pop('changed_tables', None)
+
+    if changed_tables:
+        invalidate_tables(changed_tables)
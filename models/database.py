@@ -0,0 +1,229 @@
+import contextlib
+import contextvars
+import threading
+import typing
+import settings
+import sqlalchemy
+import sqlalchemy.orm
+import sqlalchemy.ext.asyncio
+from . import instrumentation
+
+
+DATABASE_CONNECTION_URL = settings.DATABASE_URL
+
+# Асинхронные драйверы для синхронных строк подключения.
+ASYNC_DRIVERS = {
+    'sqlite': 'sqlite+aiosqlite',
+    'postgresql': 'postgresql+asyncpg',
+}
+
+
+def apply_sqlite_pragmas(dbapi_connection, pragmas: dict[str, typing.Any]) -> None:
+    """
+    Применяет PRAGMA к новому соединению SQLite.
+    """
+
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name}={value}')
+    finally:
+        cursor.close()
+
+
+def get_engine_options(url: sqlalchemy.engine.URL, kwargs: dict[str, typing.Any]) -> [dict, dict]:
+    """
+    Настройки пула из settings для строки подключения.
+    :param url: строка подключения.
+    :param kwargs: параметры, переопределяющие настройки из settings.
+    :return: параметры движка и PRAGMA для SQLite.
+    """
+
+    is_sqlite = url.get_backend_name() == 'sqlite'
+    is_memory = is_sqlite and url.database in (None, '', ':memory:')
+
+    options = {}
+    if not is_memory:
+        options.update(
+            pool_size=settings.DATABASE_POOL_SIZE,
+            max_overflow=settings.DATABASE_MAX_OVERFLOW,
+            pool_timeout=settings.DATABASE_POOL_TIMEOUT,
+            pool_recycle=settings.DATABASE_POOL_RECYCLE,
+            pool_pre_ping=not is_sqlite,
+        )
+
+    pragmas = kwargs.pop('pragmas', settings.SQLITE_PRAGMAS) if is_sqlite else None
+    options.update(kwargs)
+
+    return options, pragmas
+
+
+def listen_pragmas(sync_engine: sqlalchemy.Engine, pragmas: dict[str, typing.Any]) -> None:
+    if pragmas:
+        sqlalchemy.event.listen(
+            sync_engine,
+            'connect',
+            lambda dbapi_connection, _: apply_sqlite_pragmas(dbapi_connection, pragmas)
+        )
+
+
+def create_engine(url: str = None, **kwargs: typing.Any) -> sqlalchemy.Engine:
+    """
+    Создает движок СУБД с настройками пула и PRAGMA из settings.
+    :param url: строка подключения, по умолчанию settings.DATABASE_URL.
+    :param kwargs: параметры, переопределяющие настройки из settings.
+    :return: возвращает sqlalchemy.Engine
+    """
+
+    url = sqlalchemy.engine.make_url(url or DATABASE_CONNECTION_URL)
+    options, pragmas = get_engine_options(url, kwargs)
+
+    new_engine = sqlalchemy.create_engine(url, **options)
+    listen_pragmas(new_engine, pragmas)
+    instrumentation.install(new_engine)
+
+    return new_engine
+
+
+def create_async_engine(url: str = None, **kwargs: typing.Any) -> sqlalchemy.ext.asyncio.AsyncEngine:
+    """
+    Создает асинхронный движок СУБД с теми же настройками, что и create_engine().
+    Синхронный драйвер строки подключения заменяется асинхронным (aiosqlite, asyncpg).
+    :param url: строка подключения, по умолчанию settings.DATABASE_URL.
+    :param kwargs: параметры, переопределяющие настройки из settings.
+    :return: возвращает sqlalchemy.ext.asyncio.AsyncEngine
+    """
+
+    url = sqlalchemy.engine.make_url(url or DATABASE_CONNECTION_URL)
+    backend = url.get_backend_name()
+
+    if backend in ASYNC_DRIVERS and not url.get_dialect().is_async:
+        url = url.set(drivername=ASYNC_DRIVERS[backend])
+
+    options, pragmas = get_engine_options(url, kwargs)
+
+    new_engine = sqlalchemy.ext.asyncio.create_async_engine(url, **options)
+    listen_pragmas(new_engine.sync_engine, pragmas)
+    instrumentation.install(new_engine.sync_engine)
+
+    return new_engine
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine() -> sqlalchemy.Engine:
+    """
+    Движок СУБД процесса, создается при первом обращении.
+    Сам по себе не открывает соединений с БД.
+    """
+
+    global _engine
+
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = create_engine()
+
+    return _engine
+
+
+_async_engine = None
+
+
+def get_async_engine() -> sqlalchemy.ext.asyncio.AsyncEngine:
+    """
+    Асинхронный движок СУБД процесса, создается при первом обращении.
+    """
+
+    global _async_engine
+
+    if _async_engine is None:
+        with _engine_lock:
+            if _async_engine is None:
+                _async_engine = create_async_engine()
+
+    return _async_engine
+
+
+session_factory = sqlalchemy.orm.sessionmaker(
+    expire_on_commit=False,
+)
+
+# Отдельная сессия на каждый поток: Flet обрабатывает события
+# разных пользователей в разных потоках пула.
+session = sqlalchemy.orm.scoped_session(
+    lambda: session_factory(bind=get_engine())
+)
+
+_scope_state = threading.local()
+
+
+@contextlib.contextmanager
+def session_scope() -> typing.Iterator[sqlalchemy.orm.Session]:
+    """
+    Единица работы с БД.
+
+    Открывает сессию текущего потока, фиксирует транзакцию при успешном
+    выходе и откатывает её при любой ошибке. Вложенные вызовы используют
+    уже открытую транзакцию, поэтому несколько операций моделей можно
+    объединить в одну транзакцию внешним session_scope().
+    """
+
+    depth = getattr(_scope_state, 'depth', 0)
+    current_session = session()
+
+    if depth:
+        _scope_state.depth = depth + 1
+        try:
+            yield current_session
+        finally:
+            _scope_state.depth = depth
+        return
+
+    _scope_state.depth = 1
+    try:
+        yield current_session
+        current_session.commit()
+    except BaseException:
+        current_session.rollback()
+        raise
+    finally:
+        _scope_state.depth = 0
+        session.remove()
+
+
+async_session_factory = sqlalchemy.ext.asyncio.async_sessionmaker(
+    expire_on_commit=False,
+)
+
+_async_scope_session = contextvars.ContextVar('async_scope_session', default=None)
+
+
+@contextlib.asynccontextmanager
+async def async_session_scope() -> typing.AsyncIterator[sqlalchemy.ext.asyncio.AsyncSession]:
+    """
+    Асинхронная единица работы с БД, аналог session_scope().
+
+    Сессия привязана к текущей задаче asyncio, вложенные вызовы
+    используют уже открытую транзакцию.
+    """
+
+    current_session = _async_scope_session.get()
+
+    if current_session is not None:
+        yield current_session
+        return
+
+    current_session = async_session_factory(bind=get_async_engine())
+    token = _async_scope_session.set(current_session)
+    try:
+        yield current_session
+        await current_session.commit()
+    except BaseException:
+        await current_session.rollback()
+        raise
+    finally:
+        _async_scope_session.reset(token)
+        await current_session.close()
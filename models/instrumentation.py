@@ -0,0 +1,248 @@
+import bisect
+import collections
+import contextlib
+import contextvars
+import functools
+import inspect
+import logging
+import threading
+import time
+import typing
+import settings
+import sqlalchemy
+import sqlalchemy.orm
+
+logger = logging.getLogger(__name__)
+
+# Границы интервалов гистограммы длительности запросов, мс
+DURATION_BUCKETS = (1, 5, 10, 50, 100, 500, 1000)
+
+# Сколько разных запросов хранить по одному маршруту
+MAX_STATEMENTS_PER_ROUTE = 200
+
+# Имя, под которым учитываются запросы вне маршрутов и обработчиков
+UNTRACKED = '<untracked>'
+
+
+class Invocation:
+    """
+    Один вызов маршрута/обработчика: счетчик выполненных в нем запросов.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.queries = 0
+
+
+_current_invocation = contextvars.ContextVar('current_invocation', default=None)
+
+# Запросы, выполненные текущим ORM-вызовом SELECT: (маршрут, текст запроса).
+# Строки его результата учитываются в count_fetched_rows().
+_current_selects = contextvars.ContextVar('current_selects', default=None)
+
+
+class RouteStats:
+    """
+    Статистика запросов одного маршрута или обработчика.
+    """
+
+    def __init__(self):
+        self.invocations = 0
+        self.queries = 0
+        self.rows = 0
+        self.total_time = 0.0
+        self.max_queries_per_invocation = 0
+        self.histogram = [0] * (len(DURATION_BUCKETS) + 1)
+        self.statements = collections.Counter()
+        self.statement_rows = collections.Counter()
+
+    def add_query(self, statement: str, duration: float, rowcount: typing.Optional[int]) -> None:
+        self.queries += 1
+        self.total_time += duration
+        self.histogram[bisect.bisect_left(DURATION_BUCKETS, duration * 1000)] += 1
+
+        if statement in self.statements or len(self.statements) < MAX_STATEMENTS_PER_ROUTE:
+            self.statements[statement] += 1
+
+        if rowcount:
+            self.add_rows(statement, rowcount)
+
+    def add_rows(self, statement: str, rows: int) -> None:
+        self.rows += rows
+
+        if statement in self.statements:
+            self.statement_rows[statement] += rows
+
+    def add_invocation(self, invocation: Invocation) -> None:
+        self.invocations += 1
+        self.max_queries_per_invocation = max(self.max_queries_per_invocation, invocation.queries)
+
+    def as_dict(self, top: int = 5) -> dict[str, typing.Any]:
+        labels = [f'<={bound}ms' for bound in DURATION_BUCKETS] + [f'>{DURATION_BUCKETS[-1]}ms']
+
+        return {
+            'invocations': self.invocations,
+            'queries': self.queries,
+            'queries_per_invocation': self.queries / self.invocations if self.invocations else None,
+            'max_queries_per_invocation': self.max_queries_per_invocation,
+            'rows': self.rows,
+            'total_ms': self.total_time * 1000,
+            'histogram': dict(zip(labels, self.histogram)),
+            # (запрос, кол-во выполнений, всего строк)
+            'top_statements': [
+                (statement, count, self.statement_rows[statement])
+                for statement, count in self.statements.most_common(top)
+            ],
+        }
+
+
+_stats = collections.defaultdict(RouteStats)
+_stats_lock = threading.Lock()
+
+
+@contextlib.contextmanager
+def track(name: str) -> typing.Iterator[Invocation]:
+    """
+    Относит все запросы внутри блока к маршруту/обработчику name.
+    Вложенный track() перекрывает внешний.
+    """
+
+    invocation = Invocation(name)
+    token = _current_invocation.set(invocation)
+    try:
+        yield invocation
+    finally:
+        _current_invocation.reset(token)
+
+        with _stats_lock:
+            _stats[name].add_invocation(invocation)
+
+
+def tracked(handler: typing.Callable = None, name: str = None) -> typing.Callable:
+    """
+    Декоратор обработчика, относящий его запросы к name
+    (по умолчанию - к имени функции). Поддерживает корутины.
+    """
+
+    if handler is None:
+        return lambda function: tracked(function, name)
+
+    name = name or handler.__qualname__.replace('.<locals>', '')
+
+    if inspect.iscoroutinefunction(handler):
+        @functools.wraps(handler)
+        async def async_wrapper(*args, **kwargs):
+            with track(name):
+                return await handler(*args, **kwargs)
+
+        return async_wrapper
+
+    @functools.wraps(handler)
+    def wrapper(*args, **kwargs):
+        with track(name):
+            return handler(*args, **kwargs)
+
+    return wrapper
+
+
+def before_cursor_execute(connection, cursor, statement, parameters, context, executemany) -> None:
+    connection.info.setdefault('query_start_time', []).append(time.perf_counter())
+
+
+def after_cursor_execute(connection, cursor, statement, parameters, context, executemany) -> None:
+    duration = time.perf_counter() - connection.info['query_start_time'].pop()
+    rowcount = None
+
+    invocation = _current_invocation.get()
+    name = UNTRACKED
+
+    if invocation is not None:
+        invocation.queries += 1
+        name = invocation.name
+
+    if cursor.description is not None:
+        # Для SELECT драйверы не сообщают кол-во строк до их выборки,
+        # строки ORM-запросов считает count_fetched_rows()
+        selects = _current_selects.get()
+        if selects is not None:
+            selects.append((name, statement))
+
+    elif getattr(cursor, 'rowcount', -1) >= 0:
+        rowcount = cursor.rowcount
+
+    with _stats_lock:
+        _stats[name].add_query(statement, duration, rowcount)
+
+    if duration * 1000 >= settings.SLOW_QUERY_THRESHOLD_MS:
+        logger.warning(
+            'Медленный запрос %.1f мс (%s, строк: %s): %s',
+            duration * 1000,
+            name,
+            rowcount,
+            ' '.join(statement.split()),
+        )
+
+
+def count_fetched_rows(orm_execute_state: sqlalchemy.orm.ORMExecuteState) -> typing.Optional[sqlalchemy.Result]:
+    """
+    Считает строки результата ORM-запроса SELECT, выбирая его целиком
+    (результаты выборок моделей и так читаются полностью, см. convert_rows()).
+    Запросы связей selectinload учитываются своими вызовами этого обработчика.
+    """
+
+    if not orm_execute_state.is_select:
+        return None
+
+    selects = []
+    token = _current_selects.set(selects)
+    try:
+        result = orm_execute_state.invoke_statement()
+    finally:
+        _current_selects.reset(token)
+
+    frozen = result.freeze()
+    rows = len(frozen.data)
+
+    with _stats_lock:
+        for name, statement in selects:
+            _stats[name].add_rows(statement, rows)
+
+    return frozen()
+
+
+def handle_error(exception_context: sqlalchemy.engine.ExceptionContext) -> None:
+    connection = exception_context.connection
+    if exception_context.execution_context is not None and connection is not None \
+            and connection.info.get('query_start_time'):
+        connection.info['query_start_time'].pop()
+
+
+def install(engine: sqlalchemy.Engine) -> None:
+    """
+    Подключает учет запросов к движку (для асинхронного - к engine.sync_engine).
+    """
+
+    if not settings.QUERY_INSTRUMENTATION:
+        return
+
+    sqlalchemy.event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    sqlalchemy.event.listen(engine, 'after_cursor_execute', after_cursor_execute)
+    sqlalchemy.event.listen(engine, 'handle_error', handle_error)
+
+    if not sqlalchemy.event.contains(sqlalchemy.orm.Session, 'do_orm_execute', count_fetched_rows):
+        sqlalchemy.event.listen(sqlalchemy.orm.Session, 'do_orm_execute', count_fetched_rows)
+
+
+def get_stats(top: int = 5) -> dict[str, dict[str, typing.Any]]:
+    """
+    Статистика запросов по маршрутам и обработчикам.
+    :param top: кол-во самых частых запросов в отчете по каждому маршруту.
+    """
+
+    with _stats_lock:
+        return {name: route_stats.as_dict(top) for name, route_stats in _stats.items()}
+
+
+def reset() -> None:
+    with _stats_lock:
+        _stats.clear()
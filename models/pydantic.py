@@ -1,9 +1,9 @@
-import re
-
 import pydantic
+import typing
 from typing import Optional, Union
 from datetime import datetime
 from . import sqlalchemy
+from .validators import Email, Password, Price, QuantityLeft, get_list_adapter
 
 
 class MessageConfig:
@@ -14,9 +14,11 @@ class MessageConfig:
     }
 
 
-class PydanticModel(pydantic.BaseModel, extra=pydantic.Extra.ignore):
+class PydanticModel(pydantic.BaseModel, extra=pydantic.Extra.ignore, from_attributes=True):
     """
-    Базовая модель Pydantic
+    Базовая модель Pydantic.
+    from_attributes позволяет строить модели прямо из объектов SQLAlchemy
+    и легковесных записей выборок (см. from_rows()).
     """
 
 
@@ -25,7 +27,7 @@ class UserLoginModel(PydanticModel):
     Модель для авторизации пользователя
     """
 
-    email: str = pydantic.Field(
+    email: Email = pydantic.Field(
         title='Эл. почта',
     )
 
@@ -33,37 +35,20 @@ class UserLoginModel(PydanticModel):
         title='Пароль',
     )
 
-    @pydantic.field_validator('email')
-    def validate_email(cls, value: str):
-        if len(value) < 5:
-            raise ValueError(
-                'Поле почты должно состоять не менее чем из 5 символов.'
-            )
-
-        elif not re.match(
-            pattern=r'([A-Za-z0-9]+[.-_])*[A-Za-z0-9]+@[A-Za-z0-9-]+(\.[A-Z|a-z]{2,})+',
-            string=value
-        ):
-            raise ValueError(
-                'Неверный формат эл.почты.'
-            )
-
-        return value
-
 
 class UserRegisterModel(PydanticModel):
     """
     Модель для регистрации пользователя
     """
 
-    email: str = pydantic.Field(
+    email: Email = pydantic.Field(
         title='Эл. почта',
         description='Ваша эл.почта для регистрации аккаунта',
         serialization_alias='email',
         validation_alias=pydantic.AliasChoices('email')
     )
 
-    password: str = pydantic.Field(
+    password: Password = pydantic.Field(
         title='Пароль',
         serialization_alias='password',
         validation_alias=pydantic.AliasChoices('password')
@@ -82,32 +67,6 @@ class UserRegisterModel(PydanticModel):
         validation_alias=pydantic.AliasChoices('lastName', 'last_name')
     )
 
-    @pydantic.field_validator('email')
-    def validate_email(cls, value: str):
-        if len(value) < 5:
-            raise ValueError(
-                'Поле почты должно состоять не менее чем из 5 символов.'
-            )
-
-        elif not re.match(
-                pattern=r'([A-Za-z0-9]+[.-_])*[A-Za-z0-9]+@[A-Za-z0-9-]+(\.[A-Z|a-z]{2,})+',
-                string=value
-        ):
-            raise ValueError(
-                'Неверный формат эл.почты.'
-            )
-
-        return value
-
-    @pydantic.field_validator('password')
-    def validate_password(cls, value: str):
-        if len(value) < 8:
-            raise ValueError(
-                'Пароль должен состоять минимум из 8 символов!'
-            )
-
-        return value
-
 
 class UserModel(PydanticModel):
     """
@@ -152,6 +111,13 @@ class UserModel(PydanticModel):
         validation_alias=pydantic.AliasChoices('dateJoined', 'date_joined')
     )
 
+    avatar: Optional[str] = pydantic.Field(
+        description='Ссылка на аватар пользователя',
+        default=None,
+        serialization_alias='avatar',
+        validation_alias=pydantic.AliasChoices('avatar')
+    )
+
     role: sqlalchemy.UserRoles = pydantic.Field(
         description='Роль пользователя',
         default=sqlalchemy.UserRoles.USER,
@@ -177,19 +143,21 @@ class ProductModel(PydanticModel):
         validation_alias='title',
     )
 
-    description: str = pydantic.Field(
+    # Колонки description, price и quantityAvailable допускают NULL,
+    # поэтому модель товара, которой читаются записи БД, тоже
+    description: Optional[str] = pydantic.Field(
         title='Описание',
         serialization_alias='description',
         validation_alias='description',
     )
 
-    price: int = pydantic.Field(
+    price: Optional[Price] = pydantic.Field(
         title='Цена',
         serialization_alias='price',
         validation_alias='price',
     )
 
-    quantity_left: int = pydantic.Field(
+    quantity_left: Optional[QuantityLeft] = pydantic.Field(
         title='Кол-во на складе',
         serialization_alias='quantityLeft',
         validation_alias=pydantic.AliasChoices('quantityLeft', 'quantity_left'),
@@ -202,24 +170,6 @@ class ProductModel(PydanticModel):
         default=None
     )
 
-    @pydantic.field_validator('quantity_left')
-    def validate_quantity_left(cls, value: int):
-        if value < 0:
-            raise ValueError(
-                'Значение кол-во оставшегося товара должно быть больше нуля.'
-            )
-
-        return value
-
-    @pydantic.field_validator('price')
-    def validate_quantity_left(cls, value: int):
-        if value < 0:
-            raise ValueError(
-                'Значение цены товара должно быть больше нуля.'
-            )
-
-        return value
-
 
 class ProductCreateModel(PydanticModel):
     """
@@ -238,13 +188,13 @@ class ProductCreateModel(PydanticModel):
         validation_alias='description',
     )
 
-    price: int = pydantic.Field(
+    price: Price = pydantic.Field(
         title='Цена',
         serialization_alias='price',
         validation_alias='price',
     )
 
-    quantity_left: int = pydantic.Field(
+    quantity_left: QuantityLeft = pydantic.Field(
         title='Кол-во на складе',
         serialization_alias='quantityLeft',
         validation_alias=pydantic.AliasChoices('quantityLeft', 'quantity_left'),
@@ -256,20 +206,31 @@ class ProductCreateModel(PydanticModel):
         validation_alias='logo',
     )
 
-    @pydantic.field_validator('quantity_left')
-    def validate_quantity_left(cls, value: int):
-        if value < 0:
-            raise ValueError(
-                'Значение кол-во оставшегося товара должно быть больше нуля.'
-            )
-
-        return value
-
     @pydantic.field_validator('price')
     def validate_price(cls, value: int):
-        if value < 0:
-            raise ValueError(
-                'Значение цены товара должно быть больше нуля.'
-            )
-
+        # Цена вводится в рублях, а хранится в копейках
         return value * 100
+
+
+def validate_products(rows: typing.Iterable[dict]) -> list[ProductModel]:
+    """
+    Пакетная валидация товаров (например, при импорте) одним вызовом
+    закэшированного TypeAdapter вместо model_validate() на каждую запись.
+    :return: список моделей; при ошибке pydantic.ValidationError с индексом записи в loc.
+    """
+
+    return get_list_adapter(ProductModel).validate_python(list(rows))
+
+
+def from_rows(model: type[PydanticModel], rows: typing.Iterable[typing.Any]) -> list:
+    """
+    Пакетное преобразование записей выборки (объектов SQLAlchemy, записей
+    fast=True или AttriDict) в модели pydantic одним вызовом закэшированного
+    TypeAdapter. Валидация в pydantic-core обходится дешевле model_construct()
+    (см. benchmarks/validators.py), поэтому записи из БД тоже проверяются.
+    :param model: модель pydantic, поля которой есть у записей.
+    :param rows: записи выборки.
+    :return: список моделей.
+    """
+
+    return get_list_adapter(model).validate_python(list(rows), from_attributes=True)
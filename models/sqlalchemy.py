@@ -1,29 +1,30 @@
+import collections
 import enum
+import threading
 import typing
-import settings
 import operator
+import re
 import sqlalchemy
 import json
+import logging
 import attridict
+import sqlalchemy.dialects.postgresql
+import sqlalchemy.dialects.sqlite
 from sqlalchemy.schema import CreateColumn
 from sqlalchemy.ext.compiler import compiles
 from datetime import datetime
 from sqlalchemy.orm import DeclarativeBase
-from sqlalchemy_utils import database_exists, create_database, drop_database
-
-
-DATABASE_CONNECTION_URL = settings.DATABASE_URL
-
-# drop_database(DATABASE_CONNECTION_URL)
-if not database_exists(DATABASE_CONNECTION_URL):
-    create_database(DATABASE_CONNECTION_URL)
+from sqlalchemy_utils import database_exists, create_database
+import settings
+from .cache import ResultCache, MISSING
+from .database import get_engine, session_scope, async_session_scope
 
-engine = sqlalchemy.create_engine(DATABASE_CONNECTION_URL)
-session = sqlalchemy.orm.Session(bind=engine)
+logger = logging.getLogger(__name__)
 
 FILTER_QUERIES = {
-    'in': operator.contains,
-    'contains': operator.contains,
+    'in': sqlalchemy.sql.operators.in_op,
+    'contains': sqlalchemy.sql.operators.contains_op,
+    'icontains': sqlalchemy.sql.operators.icontains_op,
     'eq': operator.eq,
     'gt': operator.gt,
     'gte': operator.ge,
@@ -35,6 +36,83 @@ FILTER_QUERIES = {
     'index': operator.indexOf,
 }
 
+# Фильтры, значения которых можно передать связанным параметром,
+# что позволяет переиспользовать готовый запрос из кэша.
+CACHEABLE_FILTERS = {'eq', 'gt', 'gte', 'lte', 'lt', 'in', 'contains', 'icontains', 'is_not'}
+
+# Максимальное кол-во значений в одном IN (...): SQLite до 3.32
+# ограничивает число параметров запроса 999.
+IN_CHUNK_SIZE = 500
+
+# Слова поискового запроса, см. Product.get_search_query()
+SEARCH_WORD_PATTERN = re.compile(r'\w+')
+
+AGGREGATE_FUNCTIONS = {
+    'count': sqlalchemy.func.count,
+    'sum': sqlalchemy.func.sum,
+    'min': sqlalchemy.func.min,
+    'max': sqlalchemy.func.max,
+    'avg': sqlalchemy.func.avg,
+}
+
+
+class StatementCache:
+    """
+    LRU-кэш подготовленных запросов с привязанными параметрами.
+
+    Ключ - модель, тип запроса и сигнатура фильтров (без значений),
+    поэтому повторные вызовы вроде CartItem.fetch_all(user_id=...) не
+    разбирают фильтры заново, а SQLAlchemy берет скомпилированный SQL
+    из своего кэша по тому же объекту запроса.
+    """
+
+    def __init__(self, max_size: int = 512):
+        self.__max_size = max_size
+        self.__statements = collections.OrderedDict()
+        self.__lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.uncached = 0
+
+    def get_or_create(self, key: tuple, factory: typing.Callable[[], typing.Any]):
+        with self.__lock:
+            statement = self.__statements.get(key)
+            if statement is not None:
+                self.__statements.move_to_end(key)
+                self.hits += 1
+                return statement
+
+            self.misses += 1
+
+        statement = factory()
+
+        with self.__lock:
+            self.__statements[key] = statement
+            if len(self.__statements) > self.__max_size:
+                self.__statements.popitem(last=False)
+
+        return statement
+
+    def stats(self) -> dict[str, int]:
+        return {
+            'size': len(self.__statements),
+            'hits': self.hits,
+            'misses': self.misses,
+            'uncached': self.uncached,
+        }
+
+    def clear(self):
+        with self.__lock:
+            self.__statements.clear()
+            self.hits = self.misses = self.uncached = 0
+
+
+statement_cache = StatementCache()
+
+# Типы легковесных записей моделей, см. SqlAlchemyModel.get_record_type()
+_record_types = {}
+
 
 @compiles(CreateColumn, 'postgresql')
 def use_identity(element, compiler, **kw):
@@ -43,10 +121,30 @@ def use_identity(element, compiler, **kw):
     return text
 
 
+def get_dialect_insert() -> typing.Callable:
+    """
+    Возвращает конструктор INSERT текущей СУБД с поддержкой ON CONFLICT.
+    """
+
+    if get_engine().dialect.name == 'postgresql':
+        return sqlalchemy.dialects.postgresql.insert
+
+    return sqlalchemy.dialects.sqlite.insert
+
+
 def get_current_time():
     return datetime.now()
 
 
+def split_chunks(values: list, size: int = IN_CHUNK_SIZE) -> typing.Iterator[list]:
+    """
+    Части списка значений для запросов IN (...), см. IN_CHUNK_SIZE.
+    """
+
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
 class SqlAlchemyModel(DeclarativeBase):
     """
     Базовая модель СУБД проекта
@@ -58,6 +156,10 @@ class SqlAlchemyModel(DeclarativeBase):
         primary_key=True
     )
 
+    # Кэш результатов выборок модели, None - выборки всегда идут в БД.
+    # Записи из кэша общие для всех вызовов, изменять их нельзя.
+    result_cache: typing.ClassVar[typing.Optional[ResultCache]] = None
+
     def as_dict(self):
         instance_dict = self.__dict__.copy()
         instance_dict.pop('_sa_instance_state')
@@ -108,6 +210,144 @@ class SqlAlchemyModel(DeclarativeBase):
 
         return new_filters
 
+    @staticmethod
+    def get_filter_name(key: str) -> str:
+        return key.split('__')[-1] if '__' in key else 'eq'
+
+    @classmethod
+    def get_filter_signature(cls, **kwargs) -> typing.Optional[tuple]:
+        """
+        Сигнатура фильтров для кэша запросов: имена фильтров без значений.
+        Возвращает None, если фильтры нельзя выразить связанными параметрами.
+        """
+
+        signature = []
+
+        for key, value in sorted(kwargs.items()):
+            if cls.get_filter_name(key) not in CACHEABLE_FILTERS:
+                return None
+
+            # x = NULL и x IS NULL - разные запросы
+            signature.append((key, value is None))
+
+        return tuple(signature)
+
+    @classmethod
+    def compile_filters(cls, signature: tuple) -> list:
+        return [
+            cls.filter_field(key, None if is_null else sqlalchemy.bindparam(
+                f'filter_{key}',
+                expanding=cls.get_filter_name(key) == 'in'
+            ))
+            for key, is_null in signature
+        ]
+
+    @classmethod
+    def build_statement(
+            cls,
+            name: str,
+            factory: typing.Callable[[list], typing.Any],
+            filters: tuple,
+            kwargs: dict[str, typing.Any],
+            *signature_extra: typing.Hashable
+    ) -> [typing.Any, dict[str, typing.Any]]:
+        """
+        Строит запрос по фильтрам key__op, по возможности беря его из кэша.
+        :param name: тип запроса, часть ключа кэша.
+        :param factory: функция, строящая запрос по списку условий WHERE.
+        :param filters: произвольные выражения SQLAlchemy (отключают кэш).
+        :param kwargs: фильтры вида key__op=value.
+        :param signature_extra: прочие параметры, влияющие на текст запроса.
+        :return: запрос и значения его связанных параметров.
+        """
+
+        signature = None if filters else cls.get_filter_signature(**kwargs)
+
+        if signature is None:
+            statement_cache.uncached += 1
+            return factory([*filters, *cls.convert_kwargs(**kwargs)]), {}
+
+        statement = statement_cache.get_or_create(
+            (cls, name, signature, *signature_extra),
+            lambda: factory(cls.compile_filters(signature))
+        )
+
+        params = {
+            f'filter_{key}': list(value) if cls.get_filter_name(key) == 'in' else value
+            for key, value in kwargs.items()
+            if value is not None
+        }
+
+        return statement, params
+
+    @classmethod
+    def get_loader_options(cls, prefetch: typing.Iterable[str]) -> list:
+        """
+        Стратегии загрузки связей для prefetch=['product', 'order_items.product'].
+        Связи "ко многим" грузятся отдельным SELECT ... IN (selectinload),
+        связи "к одному" - через JOIN (joinedload).
+        """
+
+        options = []
+
+        for path in prefetch:
+            model = cls
+            loader = None
+
+            for name in path.split('.'):
+                attribute = getattr(model, name)
+                strategy = 'selectinload' if attribute.property.uselist else 'joinedload'
+
+                if loader is None:
+                    loader = getattr(sqlalchemy.orm, strategy)(attribute)
+                else:
+                    loader = getattr(loader, strategy)(attribute)
+
+                model = attribute.property.mapper.class_
+
+            options.append(loader)
+
+        return options
+
+    @classmethod
+    def get_record_type(cls) -> type[tuple]:
+        """
+        Неизменяемый тип записи модели (namedtuple, без __dict__) из колонок таблицы.
+        Используется выборками в быстром режиме fast=True.
+        """
+
+        record_type = _record_types.get(cls)
+
+        if record_type is None:
+            record_type = collections.namedtuple(
+                f'{cls.__name__}Record',
+                [attribute.key for attribute in sqlalchemy.inspect(cls).column_attrs]
+            )
+            _record_types[cls] = record_type
+
+        return record_type
+
+    @classmethod
+    def select_rows(cls, prefetch: tuple = (), fast: bool = False) -> sqlalchemy.Select:
+        if not fast:
+            return sqlalchemy.select(cls).options(*cls.get_loader_options(prefetch))
+
+        if prefetch:
+            raise RuntimeError(
+                'Загрузка связей недоступна в быстром режиме выборки.'
+            )
+
+        return sqlalchemy.select(*[
+            getattr(cls, key) for key in cls.get_record_type()._fields
+        ])
+
+    @classmethod
+    def convert_rows(cls, result: sqlalchemy.Result, fast: bool = False) -> list:
+        if fast:
+            return list(map(cls.get_record_type()._make, result))
+
+        return [instance.as_dict() for instance in result.unique().scalars()]
+
     @classmethod
     def decompile_filters(cls, **filters):
         result = {}
@@ -122,72 +362,895 @@ class SqlAlchemyModel(DeclarativeBase):
         return result
 
     @classmethod
-    def fetch_one(cls, *filters: typing.Callable, **kwargs: [str, typing.Any]) -> typing.Self:
-        kwargs_filters = cls.convert_kwargs(**kwargs)
+    def get_result_key(
+            cls,
+            name: str,
+            filters: tuple,
+            kwargs: dict[str, typing.Any],
+            prefetch: typing.Iterable[str] = (),
+            *extra: typing.Hashable
+    ) -> typing.Optional[tuple]:
+        """
+        Ключ result_cache для выборки. Возвращает None, если выборку нельзя
+        кэшировать: кэш модели отключен, переданы произвольные выражения
+        или связи (их изменения не сбрасывают кэш модели).
+        """
+
+        if cls.result_cache is None or filters or tuple(prefetch):
+            return None
 
-        query = session.execute(
-            sqlalchemy.select(cls).where(*filters, *kwargs_filters).limit(1)
+        key = (
+            name,
+            tuple(sorted(
+                (filter_key, tuple(value) if isinstance(value, (list, tuple)) else value)
+                for filter_key, value in kwargs.items()
+            )),
+            *extra,
         )
 
-        response = query.unique().fetchone()
-        if not response:
+        try:
+            hash(key)
+        except TypeError:
             return None
 
-        return response[0].as_dict()
+        return key
+
+    @classmethod
+    def read_through(cls, key: typing.Optional[tuple], loader: typing.Callable[[], typing.Any]) -> typing.Any:
+        if key is None:
+            return loader()
+
+        return cls.result_cache.get_or_load(key, loader)
 
     @classmethod
-    def fetch_all(cls, *filters: typing.Callable, **kwargs: [str, typing.Any]) -> typing.List[typing.Self]:
-        kwargs_filters = cls.convert_kwargs(**kwargs)
+    async def aread_through(
+            cls,
+            key: typing.Optional[tuple],
+            loader: typing.Callable[[], typing.Awaitable]
+    ) -> typing.Any:
+        if key is None:
+            return await loader()
+
+        value = cls.result_cache.get(key, MISSING)
+        if value is not MISSING:
+            return value
+
+        generation = cls.result_cache.generation
+        value = await loader()
+        cls.result_cache.set(key, value, generation)
 
-        query = session.execute(
-            sqlalchemy.select(cls).where(*filters, *kwargs_filters)
+        return value
+
+    @classmethod
+    def fetch_statement(
+            cls,
+            filters: tuple,
+            kwargs: dict[str, typing.Any],
+            prefetch: typing.Iterable[str] = (),
+            fast: bool = False,
+            limit: int = None
+    ) -> [sqlalchemy.Select, dict[str, typing.Any]]:
+        prefetch = tuple(prefetch)
+
+        return cls.build_statement(
+            'fetch',
+            lambda where: cls.select_rows(prefetch, fast).where(*where).limit(limit),
+            filters,
+            kwargs,
+            prefetch,
+            fast,
+            limit,
         )
 
-        result = query.unique().fetchall()
-        return [row[0].as_dict() for row in result]
+    @classmethod
+    def fetch_one(
+            cls,
+            *filters: typing.Callable,
+            prefetch: typing.Iterable[str] = (),
+            fast: bool = False,
+            **kwargs: [str, typing.Any]
+    ) -> typing.Self:
+        key = cls.get_result_key('fetch_one', filters, kwargs, prefetch, fast)
+        statement, params = cls.fetch_statement(filters, kwargs, prefetch, fast, limit=1)
+
+        def load():
+            with session_scope() as session:
+                rows = cls.convert_rows(session.execute(statement, params), fast)
+
+                if not rows:
+                    return None
+
+                return rows[0]
+
+        return cls.read_through(key, load)
+
+    @classmethod
+    def fetch_all(
+            cls,
+            *filters: typing.Callable,
+            prefetch: typing.Iterable[str] = (),
+            fast: bool = False,
+            **kwargs: [str, typing.Any]
+    ) -> typing.List[typing.Self]:
+        """
+        :param prefetch: связи, загружаемые вместе с записями.
+        :param fast: вернуть легковесные записи get_record_type() вместо словарей.
+        """
+
+        key = cls.get_result_key('fetch_all', filters, kwargs, prefetch, fast)
+        statement, params = cls.fetch_statement(filters, kwargs, prefetch, fast)
+
+        def load():
+            with session_scope() as session:
+                return cls.convert_rows(session.execute(statement, params), fast)
+
+        return cls.read_through(key, load)
+
+    @classmethod
+    def fetch_many_by_ids(
+            cls,
+            ids: typing.Iterable[int],
+            prefetch: typing.Iterable[str] = (),
+            fast: bool = False
+    ) -> dict[int, typing.Self]:
+        """
+        Выборка записей по списку id запросами WHERE id IN (...),
+        разбитыми на части по IN_CHUNK_SIZE значений.
+        :param ids: id записей.
+        :return: словарь id -> запись (отсутствующие в БД id пропускаются).
+        """
+
+        result, missing_ids, generation = cls.get_cached_rows(ids, prefetch, fast)
+
+        with session_scope() as session:
+            for start in range(0, len(missing_ids), IN_CHUNK_SIZE):
+                statement, params = cls.fetch_statement(
+                    (), {'id__in': missing_ids[start:start + IN_CHUNK_SIZE]}, prefetch, fast
+                )
+                rows = cls.convert_rows(session.execute(statement, params), fast)
+                result.update(cls.set_cached_rows(rows, prefetch, fast, generation))
+
+        return result
+
+    @classmethod
+    async def afetch_many_by_ids(
+            cls,
+            ids: typing.Iterable[int],
+            prefetch: typing.Iterable[str] = (),
+            fast: bool = False
+    ) -> dict[int, typing.Self]:
+        result, missing_ids, generation = cls.get_cached_rows(ids, prefetch, fast)
+
+        async with async_session_scope() as session:
+            for start in range(0, len(missing_ids), IN_CHUNK_SIZE):
+                statement, params = cls.fetch_statement(
+                    (), {'id__in': missing_ids[start:start + IN_CHUNK_SIZE]}, prefetch, fast
+                )
+                rows = cls.convert_rows(await session.execute(statement, params), fast)
+                result.update(cls.set_cached_rows(rows, prefetch, fast, generation))
+
+        return result
+
+    @classmethod
+    def get_cached_rows(
+            cls,
+            ids: typing.Iterable[int],
+            prefetch: typing.Iterable[str] = (),
+            fast: bool = False
+    ) -> [dict[int, typing.Self], list[int], typing.Optional[int]]:
+        """
+        Записи по id из result_cache.
+        :return: найденные записи, id отсутствующих в кэше записей
+            и поколение кэша для set_cached_rows().
+        """
+
+        ids = list(dict.fromkeys(ids))
+
+        if cls.result_cache is None or tuple(prefetch):
+            return {}, ids, None
+
+        generation = cls.result_cache.generation
+        result = {}
+        missing_ids = []
+
+        for row_id in ids:
+            row = cls.result_cache.get(('row', row_id, fast), MISSING)
+
+            if row is MISSING:
+                missing_ids.append(row_id)
+            else:
+                result[row_id] = row
+
+        return result, missing_ids, generation
+
+    @classmethod
+    def set_cached_rows(
+            cls,
+            rows: list,
+            prefetch: typing.Iterable[str] = (),
+            fast: bool = False,
+            generation: int = None
+    ) -> dict[int, typing.Self]:
+        result = {row.id: row for row in rows}
+
+        if cls.result_cache is not None and not tuple(prefetch):
+            for row_id, row in result.items():
+                cls.result_cache.set(('row', row_id, fast), row, generation)
+
+        return result
+
+    @classmethod
+    def fetch_page(
+            cls,
+            *filters: typing.Callable,
+            after: tuple = None,
+            limit: int = 20,
+            order_by: str = 'id',
+            prefetch: typing.Iterable[str] = (),
+            fast: bool = False,
+            **kwargs: [str, typing.Any]
+    ) -> [typing.List[typing.Self], typing.Optional[tuple]]:
+        """
+        Постраничная выборка по ключу (keyset pagination).
+        :param after: курсор, полученный с предыдущей страницы (None - первая страница).
+        :param limit: размер страницы.
+        :param order_by: поле сортировки, префикс "-" - по убыванию.
+        :param prefetch: связи, загружаемые вместе с записями.
+        :param fast: вернуть легковесные записи get_record_type() вместо словарей.
+        :return: записи страницы и курсор следующей страницы (None, если страниц больше нет).
+        """
+
+        key = cls.get_result_key('fetch_page', filters, kwargs, prefetch, after, limit, order_by, fast)
+        statement, params, order_columns = cls.page_statement(
+            filters, kwargs, after, limit, order_by, prefetch, fast
+        )
+
+        def load():
+            with session_scope() as session:
+                rows = cls.convert_rows(session.execute(statement, params), fast)
+
+            return cls.split_page(rows, limit, order_columns)
+
+        return cls.read_through(key, load)
+
+    @classmethod
+    def page_statement(
+            cls,
+            filters: tuple,
+            kwargs: dict[str, typing.Any],
+            after: tuple = None,
+            limit: int = 20,
+            order_by: str = 'id',
+            prefetch: typing.Iterable[str] = (),
+            fast: bool = False
+    ) -> [sqlalchemy.Select, dict[str, typing.Any], list]:
+        prefetch = tuple(prefetch)
+        descending = order_by.startswith('-')
+        order_field = order_by.lstrip('-')
+
+        order_columns = [getattr(cls, order_field)]
+        if order_field != 'id':
+            order_columns.append(cls.id)
+
+        def build_page_statement(where: list):
+            if after is not None:
+                cursor_filter = operator.lt if descending else operator.gt
+                where.append(cursor_filter(
+                    sqlalchemy.tuple_(*order_columns),
+                    sqlalchemy.tuple_(*[
+                        sqlalchemy.bindparam(f'cursor_{index}')
+                        for index in range(len(order_columns))
+                    ])
+                ))
+
+            return cls.select_rows(prefetch, fast).where(*where).order_by(
+                *[column.desc() if descending else column.asc() for column in order_columns]
+            ).limit(limit + 1)
+
+        statement, params = cls.build_statement(
+            'fetch_page',
+            build_page_statement,
+            filters,
+            kwargs,
+            order_by,
+            limit,
+            after is not None,
+            prefetch,
+            fast,
+        )
+
+        if after is not None:
+            params.update({f'cursor_{index}': value for index, value in enumerate(after)})
+
+        return statement, params, order_columns
+
+    @staticmethod
+    def split_page(rows: list, limit: int, order_columns: list) -> [list, typing.Optional[tuple]]:
+        if len(rows) <= limit:
+            return [rows, None]
+
+        last_row = rows[limit - 1]
+        next_cursor = tuple(getattr(last_row, column.key) for column in order_columns)
+        return [rows[:limit], next_cursor]
+
+    @classmethod
+    def count_statement(cls, filters: tuple, kwargs: dict[str, typing.Any]):
+        return cls.build_statement(
+            'count',
+            lambda where: sqlalchemy.select(sqlalchemy.func.count()).select_from(cls).where(*where),
+            filters,
+            kwargs,
+        )
+
+    @classmethod
+    def count(cls, *filters: typing.Callable, **kwargs: [str, typing.Any]) -> int:
+        """
+        Кол-во записей, подходящих под фильтры (SELECT count(*)).
+        """
+
+        key = cls.get_result_key('count', filters, kwargs)
+        statement, params = cls.count_statement(filters, kwargs)
+
+        def load():
+            with session_scope() as session:
+                return session.scalar(statement, params)
+
+        return cls.read_through(key, load)
+
+    @classmethod
+    def sum_statement(cls, column: str, filters: tuple, kwargs: dict[str, typing.Any]):
+        return cls.build_statement(
+            'sum',
+            lambda where: sqlalchemy.select(
+                sqlalchemy.func.coalesce(sqlalchemy.func.sum(getattr(cls, column)), 0)
+            ).where(*where),
+            filters,
+            kwargs,
+            column,
+        )
+
+    @classmethod
+    def sum(cls, column: str, *filters: typing.Callable, **kwargs: [str, typing.Any]) -> typing.Union[int, float]:
+        """
+        Сумма значений поля по записям, подходящим под фильтры (0, если записей нет).
+        """
+
+        statement, params = cls.sum_statement(column, filters, kwargs)
+
+        with session_scope() as session:
+            return session.scalar(statement, params)
+
+    @classmethod
+    def exists_statement(cls, filters: tuple, kwargs: dict[str, typing.Any]):
+        return cls.build_statement(
+            'exists',
+            lambda where: sqlalchemy.select(sqlalchemy.exists().where(*where)),
+            filters,
+            kwargs,
+        )
+
+    @classmethod
+    def exists(cls, *filters: typing.Callable, **kwargs: [str, typing.Any]) -> bool:
+        """
+        Проверка наличия хотя бы одной записи (SELECT EXISTS (...)).
+        """
+
+        statement, params = cls.exists_statement(filters, kwargs)
+
+        with session_scope() as session:
+            return bool(session.scalar(statement, params))
+
+    @classmethod
+    def aggregate(
+            cls,
+            *filters: typing.Callable,
+            aggregates: dict[str, tuple[str, str]],
+            group_by: typing.Union[str, typing.Iterable[str]] = (),
+            **kwargs: [str, typing.Any]
+    ) -> typing.List[attridict.AttriDict]:
+        """
+        Агрегация с группировкой одним запросом, например:
+        OrderItem.aggregate(group_by='order_id', aggregates={'total': ('sum', 'quantity')}, order_id__in=ids)
+        :param aggregates: имя результата -> (функция из AGGREGATE_FUNCTIONS, поле).
+        :param group_by: поле или поля группировки.
+        :return: строки с полями группировки и результатами агрегатов.
+        """
+
+        if isinstance(group_by, str):
+            group_by = [group_by]
+
+        group_by = tuple(group_by)
+        aggregate_items = tuple(aggregates.items())
+
+        for _, (function_name, _) in aggregate_items:
+            if function_name not in AGGREGATE_FUNCTIONS:
+                raise RuntimeError(
+                    f'Агрегатной функции "{function_name}" не существует.'
+                )
+
+        def build_aggregate_statement(where: list):
+            group_columns = [getattr(cls, key) for key in group_by]
+
+            return sqlalchemy.select(
+                *[column.label(column.key) for column in group_columns],
+                *[
+                    AGGREGATE_FUNCTIONS[function_name](getattr(cls, column)).label(name)
+                    for name, (function_name, column) in aggregate_items
+                ]
+            ).where(*where).group_by(*group_columns)
+
+        statement, params = cls.build_statement(
+            'aggregate',
+            build_aggregate_statement,
+            filters,
+            kwargs,
+            group_by,
+            aggregate_items,
+        )
+
+        with session_scope() as session:
+            return [
+                attridict.AttriDict(row._asdict())
+                for row in session.execute(statement, params)
+            ]
 
     @classmethod
     def create(cls, **kwargs) -> typing.Self:
+        with session_scope() as session:
+            instance = session.scalars(cls.create_statement(kwargs)).one()
+
+            return instance.as_dict()
+
+    @classmethod
+    def create_statement(cls, kwargs: dict[str, typing.Any]) -> sqlalchemy.Insert:
         if 'id' in kwargs:
             kwargs.pop('id')
 
-        result = session.execute(
-            sqlalchemy.insert(cls).values(**kwargs)
-        )
-
-        session.commit()
-        return cls.fetch_one(id=result.inserted_primary_key[0])
+        return sqlalchemy.insert(cls).values(**kwargs).returning(cls)
 
     @classmethod
     def fetch_or_create(cls, **kwargs: [str, typing.Any]) -> [typing.Self, bool]:
-        data = cls.fetch_one(**kwargs)
+        with session_scope():
+            data = cls.fetch_one(**kwargs)
 
-        if not data:
-            kwargs_decompiled = cls.decompile_filters(**kwargs)
-            return [cls.create(**kwargs_decompiled), True]
+            if not data:
+                kwargs_decompiled = cls.decompile_filters(**kwargs)
+                return [cls.create(**kwargs_decompiled), True]
 
-        return [data, False]
+            return [data, False]
 
     @classmethod
     def delete(cls,  *filters: typing.Callable, **kwargs: [str, typing.Any]) -> None:
-        kwargs_filters = cls.convert_kwargs(**kwargs)
+        statement, params = cls.delete_statement(filters, kwargs)
 
-        session.execute(
-            sqlalchemy.delete(cls).where(*filters, *kwargs_filters)
-        )
+        with session_scope() as session:
+            session.execute(statement, params)
 
-        return session.commit()
+    @classmethod
+    def delete_statement(cls, filters: tuple, kwargs: dict[str, typing.Any]):
+        return cls.build_statement(
+            'delete',
+            lambda where: sqlalchemy.delete(cls).where(*where),
+            filters,
+            kwargs,
+        )
 
     @classmethod
     def update(cls, row_id: int, **kwargs) -> typing.Self:
-        filter_query = cls.convert_kwargs(id=row_id)
+        statement, params = cls.update_statement(row_id, kwargs)
+
+        with session_scope() as session:
+            instance = session.scalars(
+                statement,
+                params,
+                execution_options={'populate_existing': True}
+            ).one_or_none()
+
+            if not instance:
+                return None
+
+            return instance.as_dict()
+
+    @classmethod
+    def update_statement(cls, row_id: int, kwargs: dict[str, typing.Any]):
+        values = sorted(kwargs)
+
+        statement, params = cls.build_statement(
+            'update',
+            lambda where: sqlalchemy.update(cls).where(*where).values({
+                key: sqlalchemy.bindparam(f'value_{key}') for key in values
+            }).returning(cls),
+            (),
+            {'id': row_id},
+            tuple(values),
+        )
+
+        params.update({f'value_{key}': value for key, value in kwargs.items()})
+
+        return statement, params
+
+    @classmethod
+    def upsert(
+            cls,
+            conflict_columns: typing.Iterable[str],
+            update_columns: typing.Iterable[str] = None,
+            **kwargs: typing.Any
+    ) -> typing.Self:
+        """
+        Вставка записи либо обновление существующей одним запросом
+        INSERT ... ON CONFLICT DO UPDATE ... RETURNING.
+        :param conflict_columns: поля уникального ограничения.
+        :param update_columns: поля, обновляемые при конфликте (по умолчанию все переданные, кроме conflict_columns).
+            Если обновлять нечего, существующая запись возвращается без изменений.
+        :param kwargs: значения записи.
+        :return: возвращает итоговую запись.
+        """
+
+        conflict_columns = list(conflict_columns)
+
+        # id передается в VALUES, только если конфликт ищется по первичному ключу
+        if 'id' not in conflict_columns:
+            kwargs.pop('id', None)
+
+        if update_columns is None:
+            update_columns = [key for key in kwargs if key not in conflict_columns]
+
+        # ON CONFLICT DO NOTHING не возвращает существующую запись в RETURNING,
+        # поэтому без обновляемых полей поля конфликта присваиваются сами себе.
+        update_columns = list(update_columns) or conflict_columns
+
+        columns = cls.__mapper__.columns
+
+        statement = get_dialect_insert()(cls).values(**kwargs)
+        statement = statement.on_conflict_do_update(
+            index_elements=[columns[key] for key in conflict_columns],
+            set_={
+                columns[key]: statement.excluded[columns[key].key]
+                for key in update_columns
+            },
+        )
+
+        return cls.execute_returning(statement)
 
-        query = session.execute(
-            sqlalchemy.update(cls).where(*filter_query).values(**kwargs)
+    @classmethod
+    def increment(
+            cls,
+            conflict_columns: typing.Iterable[str],
+            column: str,
+            amount: int = 1,
+            **kwargs: typing.Any
+    ) -> typing.Self:
+        """
+        Атомарное увеличение счетчика одним запросом
+        INSERT ... ON CONFLICT DO UPDATE SET column = column + :amount RETURNING.
+        Если записи еще нет, она создается со значением column = amount.
+        :param conflict_columns: поля уникального ограничения.
+        :param column: увеличиваемое поле.
+        :param amount: величина изменения.
+        :param kwargs: значения записи.
+        :return: возвращает итоговую запись.
+        """
+
+        return cls.execute_returning(
+            cls.increment_statement(conflict_columns, column, amount, kwargs)
         )
 
-        session.commit()
-        return cls.fetch_one(id=query.lastrowid)
+    @classmethod
+    def add_to_field(
+            cls,
+            row_id: int,
+            column: str,
+            amount: int,
+            minimum: int = None
+    ) -> typing.Optional[typing.Self]:
+        """
+        Атомарное изменение числового поля существующей записи одним запросом
+        UPDATE ... SET column = column + :amount WHERE id = :row_id RETURNING.
+        :param row_id: id записи.
+        :param column: изменяемое поле.
+        :param amount: величина изменения (может быть отрицательной).
+        :param minimum: наименьшее допустимое значение поля после изменения.
+        :return: обновленная запись, либо None, если записи нет или значение
+            стало бы меньше minimum (запись при этом не меняется).
+        """
+
+        target = getattr(cls, column)
+        statement = sqlalchemy.update(cls).where(cls.id == row_id).values({target: target + amount})
+
+        if minimum is not None:
+            statement = statement.where(target + amount >= minimum)
+
+        with session_scope() as session:
+            instance = session.scalars(
+                statement.returning(cls),
+                execution_options={'populate_existing': True}
+            ).one_or_none()
+
+            return instance.as_dict() if instance is not None else None
+
+    @classmethod
+    def increment_statement(
+            cls,
+            conflict_columns: typing.Iterable[str],
+            column: str,
+            amount: int,
+            kwargs: dict[str, typing.Any]
+    ) -> sqlalchemy.Insert:
+        conflict_columns = list(conflict_columns)
+
+        if 'id' not in conflict_columns:
+            kwargs.pop('id', None)
+
+        kwargs[column] = amount
+        columns = cls.__mapper__.columns
+        target = columns[column]
+
+        statement = get_dialect_insert()(cls).values(**kwargs)
+        return statement.on_conflict_do_update(
+            index_elements=[columns[key] for key in conflict_columns],
+            set_={target: target + statement.excluded[target.key]},
+        )
+
+    @classmethod
+    def execute_returning(cls, statement: sqlalchemy.Executable) -> typing.Self:
+        with session_scope() as session:
+            instance = session.scalars(
+                statement.returning(cls),
+                execution_options={'populate_existing': True}
+            ).one()
+
+            return instance.as_dict()
+
+    @classmethod
+    def create_many(
+            cls,
+            rows: typing.Iterable[dict[str, typing.Any]],
+            returning: bool = False
+    ) -> typing.Union[int, typing.List[typing.Self]]:
+        """
+        Пакетное создание записей одной транзакцией (executemany).
+        :param rows: словари значений новых записей.
+        :param returning: вернуть созданные записи вместо их количества.
+        :return: кол-во созданных записей либо список записей.
+        """
+
+        rows = [
+            {key: value for key, value in row.items() if key != 'id'}
+            for row in rows
+        ]
+
+        if not rows:
+            return [] if returning else 0
+
+        with session_scope() as session:
+            if returning:
+                result = session.scalars(
+                    sqlalchemy.insert(cls).returning(cls),
+                    rows
+                )
+                return [item.as_dict() for item in result.all()]
+
+            session.execute(sqlalchemy.insert(cls), rows)
+            return len(rows)
+
+    @classmethod
+    def update_many(
+            cls,
+            rows: typing.Iterable[dict[str, typing.Any]],
+            returning: bool = False
+    ) -> typing.Union[int, typing.List[typing.Self]]:
+        """
+        Пакетное обновление записей по первичному ключу одной транзакцией.
+        Записи с id, которых нет в таблице, пропускаются и не учитываются.
+        Несколько записей с одним id применяются по порядку (побеждает
+        последняя), а строка учитывается один раз.
+        :param rows: словари значений, каждый обязательно содержит 'id'.
+        :param returning: вернуть обновленные записи вместо их количества.
+        :return: кол-во обновленных записей либо список записей.
+        """
+
+        rows = list(rows)
+
+        if any('id' not in row for row in rows):
+            raise RuntimeError(
+                'Для пакетного обновления каждая запись должна содержать "id".'
+            )
+
+        if not rows:
+            return [] if returning else 0
+
+        with session_scope() as session:
+            # Обновление по первичному ключу проверяет кол-во затронутых строк
+            # и бросает StaleDataError, если какого-то id нет в таблице,
+            # поэтому отсутствующие id отбрасываются заранее.
+            existing_ids = set()
+            for ids in split_chunks(list({row['id'] for row in rows})):
+                existing_ids.update(session.scalars(sqlalchemy.select(cls.id).where(cls.id.in_(ids))))
+
+            rows = [row for row in rows if row['id'] in existing_ids]
+            if rows:
+                session.execute(sqlalchemy.update(cls), rows)
+
+            updated_ids = list({row['id'] for row in rows})
+
+            if not returning:
+                return len(updated_ids)
+
+            result = []
+            for ids in split_chunks(updated_ids):
+                instances = session.scalars(
+                    sqlalchemy.select(cls).where(cls.id.in_(ids)),
+                    execution_options={'populate_existing': True}
+                )
+                result.extend(instance.as_dict() for instance in instances)
+
+            return result
+
+    @classmethod
+    def delete_many(cls, ids: typing.Iterable[int]) -> int:
+        """
+        Пакетное удаление записей по списку id запросами, разбитыми
+        на части по IN_CHUNK_SIZE значений.
+        :param ids: id удаляемых записей.
+        :return: кол-во удаленных записей.
+        """
+
+        ids = list(ids)
+        if not ids:
+            return 0
+
+        deleted = 0
+
+        with session_scope() as session:
+            for chunk in split_chunks(ids):
+                deleted += session.execute(
+                    sqlalchemy.delete(cls).where(cls.id.in_(chunk))
+                ).rowcount
+
+        return deleted
+
+    # Асинхронные версии методов. Запросы собираются теми же *_statement()
+    # и разделяют с синхронными кэш скомпилированных запросов.
+
+    @classmethod
+    async def afetch_one(
+            cls,
+            *filters: typing.Callable,
+            prefetch: typing.Iterable[str] = (),
+            fast: bool = False,
+            **kwargs: [str, typing.Any]
+    ) -> typing.Self:
+        key = cls.get_result_key('fetch_one', filters, kwargs, prefetch, fast)
+        statement, params = cls.fetch_statement(filters, kwargs, prefetch, fast, limit=1)
+
+        async def load():
+            async with async_session_scope() as session:
+                rows = cls.convert_rows(await session.execute(statement, params), fast)
+
+                if not rows:
+                    return None
+
+                return rows[0]
+
+        return await cls.aread_through(key, load)
+
+    @classmethod
+    async def afetch_all(
+            cls,
+            *filters: typing.Callable,
+            prefetch: typing.Iterable[str] = (),
+            fast: bool = False,
+            **kwargs: [str, typing.Any]
+    ) -> typing.List[typing.Self]:
+        key = cls.get_result_key('fetch_all', filters, kwargs, prefetch, fast)
+        statement, params = cls.fetch_statement(filters, kwargs, prefetch, fast)
+
+        async def load():
+            async with async_session_scope() as session:
+                return cls.convert_rows(await session.execute(statement, params), fast)
+
+        return await cls.aread_through(key, load)
+
+    @classmethod
+    async def afetch_page(
+            cls,
+            *filters: typing.Callable,
+            after: tuple = None,
+            limit: int = 20,
+            order_by: str = 'id',
+            prefetch: typing.Iterable[str] = (),
+            fast: bool = False,
+            **kwargs: [str, typing.Any]
+    ) -> [typing.List[typing.Self], typing.Optional[tuple]]:
+        key = cls.get_result_key('fetch_page', filters, kwargs, prefetch, after, limit, order_by, fast)
+        statement, params, order_columns = cls.page_statement(
+            filters, kwargs, after, limit, order_by, prefetch, fast
+        )
+
+        async def load():
+            async with async_session_scope() as session:
+                rows = cls.convert_rows(await session.execute(statement, params), fast)
+
+            return cls.split_page(rows, limit, order_columns)
+
+        return await cls.aread_through(key, load)
+
+    @classmethod
+    async def acount(cls, *filters: typing.Callable, **kwargs: [str, typing.Any]) -> int:
+        key = cls.get_result_key('count', filters, kwargs)
+        statement, params = cls.count_statement(filters, kwargs)
+
+        async def load():
+            async with async_session_scope() as session:
+                return await session.scalar(statement, params)
+
+        return await cls.aread_through(key, load)
+
+    @classmethod
+    async def asum(cls, column: str, *filters: typing.Callable, **kwargs: [str, typing.Any]) -> typing.Union[int, float]:
+        statement, params = cls.sum_statement(column, filters, kwargs)
+
+        async with async_session_scope() as session:
+            return await session.scalar(statement, params)
+
+    @classmethod
+    async def aexists(cls, *filters: typing.Callable, **kwargs: [str, typing.Any]) -> bool:
+        statement, params = cls.exists_statement(filters, kwargs)
+
+        async with async_session_scope() as session:
+            return bool(await session.scalar(statement, params))
+
+    @classmethod
+    async def acreate(cls, **kwargs) -> typing.Self:
+        async with async_session_scope() as session:
+            instance = (await session.scalars(cls.create_statement(kwargs))).one()
+
+            return instance.as_dict()
+
+    @classmethod
+    async def aupdate(cls, row_id: int, **kwargs) -> typing.Self:
+        statement, params = cls.update_statement(row_id, kwargs)
+
+        async with async_session_scope() as session:
+            instance = (await session.scalars(
+                statement,
+                params,
+                execution_options={'populate_existing': True}
+            )).one_or_none()
+
+            if not instance:
+                return None
+
+            return instance.as_dict()
+
+    @classmethod
+    async def adelete(cls, *filters: typing.Callable, **kwargs: [str, typing.Any]) -> None:
+        statement, params = cls.delete_statement(filters, kwargs)
+
+        async with async_session_scope() as session:
+            await session.execute(statement, params)
+
+    @classmethod
+    async def aincrement(
+            cls,
+            conflict_columns: typing.Iterable[str],
+            column: str,
+            amount: int = 1,
+            **kwargs: typing.Any
+    ) -> typing.Self:
+        return await cls.aexecute_returning(
+            cls.increment_statement(conflict_columns, column, amount, kwargs)
+        )
+
+    @classmethod
+    async def aexecute_returning(cls, statement: sqlalchemy.Executable) -> typing.Self:
+        async with async_session_scope() as session:
+            instance = (await session.scalars(
+                statement.returning(cls),
+                execution_options={'populate_existing': True}
+            )).one()
+
+            return instance.as_dict()
 
 
 class UserRoles(enum.Enum):
@@ -206,6 +1269,17 @@ class User(SqlAlchemyModel):
 
     __tablename__ = 'users'
 
+    # Сессии восстанавливают пользователя по id при каждом подключении
+    result_cache = ResultCache(
+        ['users'],
+        max_size=settings.USER_CACHE_SIZE,
+        ttl=settings.USER_CACHE_TTL,
+    )
+
+    __table_args__ = (
+        sqlalchemy.Index('ux_users_email', 'email', unique=True),
+    )
+
     email = sqlalchemy.Column(
         sqlalchemy.VARCHAR(255),
         nullable=False,
@@ -244,6 +1318,16 @@ class User(SqlAlchemyModel):
         name='avatar'
     )
 
+    # Версия сессий: входит в токен сессии, увеличение отзывает все
+    # выданные пользователю токены (см. services.sessions.SessionStore)
+    session_version = sqlalchemy.Column(
+        sqlalchemy.Integer(),
+        nullable=False,
+        default=0,
+        server_default='0',
+        name='sessionVersion'
+    )
+
     role: sqlalchemy.orm.Mapped[UserRoles] = sqlalchemy.orm.mapped_column(
         default=UserRoles.USER
     )
@@ -256,6 +1340,23 @@ class Product(SqlAlchemyModel):
 
     __tablename__ = 'products'
 
+    # Каталог меняется редко, а читается при каждом открытии главной страницы
+    result_cache = ResultCache(
+        ['products'],
+        max_size=settings.PRODUCT_CACHE_SIZE,
+        ttl=settings.PRODUCT_CACHE_TTL,
+    )
+
+    __table_args__ = (
+        # Частичный индекс: каталог выбирает только товары в наличии
+        sqlalchemy.Index(
+            'ix_products_in_stock',
+            'id',
+            sqlite_where=sqlalchemy.text('"quantityAvailable" > 0'),
+            postgresql_where=sqlalchemy.text('"quantityAvailable" > 0'),
+        ),
+    )
+
     title = sqlalchemy.Column(
         sqlalchemy.VARCHAR(256),
         nullable=False,
@@ -285,6 +1386,123 @@ class Product(SqlAlchemyModel):
         name='logo',
     )
 
+    @staticmethod
+    def get_search_query(query: str) -> typing.Optional[str]:
+        """
+        Запрос FTS5 из строки поиска: каждое слово ищется как префикс
+        ("банк" найдет "банка"), все слова должны встречаться в товаре.
+        :return: выражение MATCH, либо None, если в строке нет слов.
+        """
+
+        words = SEARCH_WORD_PATTERN.findall(query or '')
+        if not words:
+            return None
+
+        return ' '.join(f'"{word}"*' for word in words)
+
+    @classmethod
+    def search(
+            cls,
+            query: str,
+            limit: int = 20,
+            after: tuple = None,
+            fast: bool = False,
+            **kwargs: [str, typing.Any]
+    ) -> [typing.List[typing.Self], typing.Optional[tuple]]:
+        """
+        Полнотекстовый поиск товаров по названию и описанию (таблица products_fts).
+        Результаты упорядочены по релевантности bm25, название весит больше описания.
+        :param query: строка поиска.
+        :param limit: размер страницы.
+        :param after: курсор, полученный с предыдущей страницы (None - первая страница).
+        :param fast: вернуть легковесные записи get_record_type() вместо словарей.
+        :param kwargs: дополнительные фильтры вида key__op=value.
+        :return: записи страницы и курсор следующей страницы (None, если страниц больше нет).
+        """
+
+        search_query = cls.get_search_query(query)
+        if search_query is None:
+            return [[], None]
+
+        if get_engine().dialect.name != 'sqlite':
+            pattern = f'%{query.strip()}%'
+            return cls.fetch_page(
+                sqlalchemy.or_(cls.title.ilike(pattern), cls.description.ilike(pattern)),
+                after=after,
+                limit=limit,
+                fast=fast,
+                **kwargs
+            )
+
+        key = cls.get_result_key('search', (), kwargs, (), search_query, after, limit, fast)
+        statement, params = cls.search_statement(kwargs, after, limit, fast)
+        params['search_query'] = search_query
+
+        def load():
+            with session_scope() as session:
+                rows = session.execute(statement, params).all()
+
+            if fast:
+                record_type = cls.get_record_type()
+                records = [record_type._make(row[:-1]) for row in rows]
+            else:
+                records = [row[0].as_dict() for row in rows]
+
+            if len(rows) <= limit:
+                return [records, None]
+
+            last_row = rows[limit - 1]
+            return [records[:limit], (last_row.rank, records[limit - 1].id)]
+
+        return cls.read_through(key, load)
+
+    @classmethod
+    def search_statement(
+            cls,
+            kwargs: dict[str, typing.Any],
+            after: tuple = None,
+            limit: int = 20,
+            fast: bool = False
+    ) -> [sqlalchemy.Select, dict[str, typing.Any]]:
+        search_table = sqlalchemy.table(SEARCH_TABLE, sqlalchemy.column('rowid'))
+        search_match = sqlalchemy.literal_column(SEARCH_TABLE)
+
+        # bm25() доступна только в запросе к самой таблице FTS5
+        ranked = sqlalchemy.select(
+            search_table.c.rowid.label('id'),
+            sqlalchemy.func.bm25(search_match, 10.0, 1.0).label('rank'),
+        ).where(
+            search_match.op('MATCH')(sqlalchemy.bindparam('search_query'))
+        ).subquery('ranked')
+
+        def build_search_statement(where: list):
+            if after is not None:
+                where.append(
+                    sqlalchemy.tuple_(ranked.c.rank, cls.id) > sqlalchemy.tuple_(
+                        sqlalchemy.bindparam('cursor_0'),
+                        sqlalchemy.bindparam('cursor_1'),
+                    )
+                )
+
+            return cls.select_rows((), fast).add_columns(ranked.c.rank).join(
+                ranked, ranked.c.id == cls.id
+            ).where(*where).order_by(ranked.c.rank, cls.id).limit(limit + 1)
+
+        statement, params = cls.build_statement(
+            'search',
+            build_search_statement,
+            (),
+            kwargs,
+            limit,
+            after is not None,
+            fast,
+        )
+
+        if after is not None:
+            params.update({f'cursor_{index}': value for index, value in enumerate(after)})
+
+        return statement, params
+
 
 class Order(SqlAlchemyModel):
     """
@@ -292,6 +1510,9 @@ class Order(SqlAlchemyModel):
     """
 
     __tablename__ = 'orders'
+    __table_args__ = (
+        sqlalchemy.Index('ix_orders_user_id', 'user_id'),
+    )
 
     user_id = sqlalchemy.Column(
         sqlalchemy.ForeignKey(
@@ -302,7 +1523,6 @@ class Order(SqlAlchemyModel):
 
     user = sqlalchemy.orm.relationship(
         'User',
-        lazy='immediate',
         backref=sqlalchemy.orm.backref(
             'orders'
         )
@@ -325,6 +1545,38 @@ class Order(SqlAlchemyModel):
         default='Тверь'
     )
 
+    @classmethod
+    def fetch_history(
+            cls,
+            user_id: int,
+            after: tuple = None,
+            limit: int = 20
+    ) -> [typing.List[typing.Self], typing.Optional[tuple]]:
+        """
+        Страница истории заказов пользователя, от новых к старым.
+        Заказы загружаются вместе с пользователем, товарами заказа и их
+        товарами фиксированным числом запросов (заказы + одна выборка
+        order_items ... WHERE order_id IN (...) для всей страницы),
+        независимо от кол-ва заказов.
+        :param user_id: id пользователя.
+        :param after: курсор, полученный с предыдущей страницы (None - первая страница).
+        :param limit: размер страницы.
+        :return: заказы с полями order_items и total_quantity и курсор следующей страницы.
+        """
+
+        orders, next_cursor = cls.fetch_page(
+            after=after,
+            limit=limit,
+            order_by='-id',
+            prefetch=['user', 'order_items.product'],
+            user_id=user_id,
+        )
+
+        for order in orders:
+            order.total_quantity = sum(item.quantity for item in order.order_items)
+
+        return [orders, next_cursor]
+
 
 class OrderItem(SqlAlchemyModel):
     """
@@ -332,6 +1584,10 @@ class OrderItem(SqlAlchemyModel):
     """
 
     __tablename__ = 'order_items'
+    __table_args__ = (
+        sqlalchemy.Index('ix_order_items_order_id', 'order_id'),
+        sqlalchemy.Index('ix_order_items_product_id', 'product_id'),
+    )
 
     order_id = sqlalchemy.Column(
         sqlalchemy.ForeignKey(
@@ -342,8 +1598,7 @@ class OrderItem(SqlAlchemyModel):
 
     order = sqlalchemy.orm.relationship(
         'Order',
-        lazy='immediate',
-        backref=sqlalchemy.orm.backref('order_items', lazy='immediate')
+        backref=sqlalchemy.orm.backref('order_items')
     )
 
     product_id = sqlalchemy.Column(
@@ -355,10 +1610,8 @@ class OrderItem(SqlAlchemyModel):
 
     product = sqlalchemy.orm.relationship(
         'Product',
-        lazy='immediate',
         backref=sqlalchemy.orm.backref(
-            'order_items',
-            lazy='immediate'
+            'order_items'
         )
     )
 
@@ -374,6 +1627,12 @@ class CartItem(SqlAlchemyModel):
     """
 
     __tablename__ = 'cart_items'
+    __table_args__ = (
+        # Одна строка корзины на пару (пользователь, товар), индекс также
+        # покрывает выборку корзины по user_id
+        sqlalchemy.Index('ux_cart_items_user_product', 'user_id', 'product_id', unique=True),
+        sqlalchemy.Index('ix_cart_items_product_id', 'product_id'),
+    )
 
     product_id = sqlalchemy.Column(
         sqlalchemy.ForeignKey(
@@ -384,7 +1643,6 @@ class CartItem(SqlAlchemyModel):
 
     product = sqlalchemy.orm.relationship(
         'Product',
-        lazy='immediate',
         backref=sqlalchemy.orm.backref(
             'cart_items'
         ),
@@ -405,11 +1663,243 @@ class CartItem(SqlAlchemyModel):
 
     user = sqlalchemy.orm.relationship(
         'User',
-        lazy='immediate',
         backref=sqlalchemy.orm.backref(
             'cart_items'
         )
     )
 
 
-SqlAlchemyModel.metadata.create_all(bind=engine)
+def merge_duplicate_cart_items(connection: sqlalchemy.Connection) -> int:
+    """
+    Объединяет строки корзины с одинаковой парой (пользователь, товар),
+    которые могли появиться до уникального индекса ux_cart_items_user_product:
+    остается строка с наименьшим id и суммарным кол-вом, остальные удаляются.
+    :return: кол-во удаленных строк.
+    """
+
+    table = CartItem.__table__
+    duplicate = table.alias('duplicate')
+    kept = table.alias('kept')
+
+    kept_ids = sqlalchemy.select(sqlalchemy.func.min(kept.c.id)).group_by(kept.c.user_id, kept.c.product_id)
+    total_quantity = sqlalchemy.select(sqlalchemy.func.sum(duplicate.c.quantity)).where(
+        duplicate.c.user_id == table.c.user_id,
+        duplicate.c.product_id == table.c.product_id,
+    ).scalar_subquery()
+
+    connection.execute(
+        sqlalchemy.update(table)
+        .where(table.c.id.in_(kept_ids.having(sqlalchemy.func.count() > 1)))
+        .values({table.c.quantity: total_quantity})
+    )
+
+    return connection.execute(
+        sqlalchemy.delete(table).where(table.c.id.not_in(kept_ids))
+    ).rowcount
+
+
+# Функции, устраняющие дубликаты перед созданием уникального индекса
+INDEX_DEDUPLICATORS = {
+    'ux_cart_items_user_product': merge_duplicate_cart_items,
+}
+
+
+def create_missing_columns(bind: sqlalchemy.Engine) -> list[str]:
+    """
+    Добавляет в существующие таблицы колонки моделей, которых в них еще нет
+    (create_all не изменяет уже созданные таблицы). Колонки NOT NULL
+    должны иметь server_default, чтобы заполниться в существующих строках.
+    :return: имена добавленных колонок вида "таблица.колонка".
+    """
+
+    inspector = sqlalchemy.inspect(bind)
+    created = []
+
+    for table in SqlAlchemyModel.metadata.sorted_tables:
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+
+        for column in table.columns:
+            if column.name in existing:
+                continue
+
+            definition = CreateColumn(column).compile(dialect=bind.dialect)
+            with bind.begin() as connection:
+                connection.execute(sqlalchemy.text(
+                    f'ALTER TABLE {bind.dialect.identifier_preparer.format_table(table)} ADD COLUMN {definition}'
+                ))
+
+            created.append(f'{table.name}.{column.name}')
+
+    return created
+
+
+def create_missing_indexes(bind: sqlalchemy.Engine) -> list[str]:
+    """
+    Создает индексы моделей, которых еще нет в существующей БД
+    (create_all не трогает индексы уже созданных таблиц).
+    Если уникальный индекс нельзя создать из-за дубликатов, которые не
+    устраняются автоматически (см. INDEX_DEDUPLICATORS), выбрасывается
+    RuntimeError: без индекса не работают запросы ON CONFLICT.
+    :return: имена созданных индексов.
+    """
+
+    inspector = sqlalchemy.inspect(bind)
+    created = []
+
+    for table in SqlAlchemyModel.metadata.sorted_tables:
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+
+            try:
+                with bind.begin() as connection:
+                    if index.name in INDEX_DEDUPLICATORS:
+                        merged = INDEX_DEDUPLICATORS[index.name](connection)
+                        if merged:
+                            logger.warning(
+                                'Перед созданием индекса %s объединено дубликатов в таблице %s: %s.',
+                                index.name, table.name, merged
+                            )
+
+                    index.create(bind=connection)
+            except sqlalchemy.exc.IntegrityError as error:
+                raise RuntimeError(
+                    f'Не удалось создать уникальный индекс {index.name}: '
+                    f'в таблице {table.name} есть дубликаты ({error.orig}).'
+                ) from error
+
+            created.append(index.name)
+
+    return created
+
+
+# Версия схемы БД. Увеличивается при любом изменении моделей, индексов
+# и прочих объектов, которые создает init_db().
+SCHEMA_VERSION = 3
+
+# Полнотекстовый индекс товаров (SQLite FTS5), синхронизируется триггерами
+SEARCH_TABLE = 'products_fts'
+
+SEARCH_TABLE_DDL = [
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5(
+        title,
+        description,
+        content='products',
+        content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2',
+        prefix='2 3'
+    )
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_insert AFTER INSERT ON products BEGIN
+        INSERT INTO {SEARCH_TABLE} (rowid, title, description)
+        VALUES (new.id, new.title, new.description);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_delete AFTER DELETE ON products BEGIN
+        INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}, rowid, title, description)
+        VALUES ('delete', old.id, old.title, old.description);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_update AFTER UPDATE OF title, description ON products BEGIN
+        INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}, rowid, title, description)
+        VALUES ('delete', old.id, old.title, old.description);
+        INSERT INTO {SEARCH_TABLE} (rowid, title, description)
+        VALUES (new.id, new.title, new.description);
+    END
+    """,
+]
+
+schema_version_table = sqlalchemy.Table(
+    'schema_version',
+    SqlAlchemyModel.metadata,
+    sqlalchemy.Column('version', sqlalchemy.Integer(), nullable=False),
+)
+
+_db_initialized = False
+_db_init_lock = threading.Lock()
+
+
+def create_search_index(bind: sqlalchemy.Engine) -> None:
+    """
+    Создает таблицу FTS5 для Product.search() и триггеры, поддерживающие
+    ее в актуальном состоянии. Новая таблица заполняется уже существующими
+    товарами. Для СУБД, отличных от SQLite, ничего не делает.
+    """
+
+    if bind.dialect.name != 'sqlite':
+        return
+
+    with bind.begin() as connection:
+        exists = SEARCH_TABLE in sqlalchemy.inspect(connection).get_table_names()
+
+        for statement in SEARCH_TABLE_DDL:
+            connection.execute(sqlalchemy.text(statement))
+
+        if not exists:
+            connection.execute(sqlalchemy.text(
+                f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}) VALUES ('rebuild')"
+            ))
+
+
+def get_schema_version(bind: sqlalchemy.Engine) -> typing.Optional[int]:
+    """
+    Версия схемы, записанная в БД, либо None для новой/недоступной БД.
+    """
+
+    try:
+        with bind.connect() as connection:
+            return connection.scalar(
+                sqlalchemy.select(sqlalchemy.func.max(schema_version_table.c.version))
+            )
+    except sqlalchemy.exc.DBAPIError:
+        return None
+
+
+def init_db(force: bool = False) -> bool:
+    """
+    Идемпотентная инициализация БД: создание самой БД, таблиц и индексов.
+
+    Если записанная в БД версия схемы совпадает с SCHEMA_VERSION, вся работа
+    сводится к одному чтению таблицы schema_version; повторные вызовы
+    в том же процессе ничего не делают.
+    :param force: выполнить инициализацию независимо от версии схемы.
+    :return: True, если схема создавалась или обновлялась.
+    """
+
+    global _db_initialized
+
+    if _db_initialized and not force:
+        return False
+
+    with _db_init_lock:
+        if _db_initialized and not force:
+            return False
+
+        bind = get_engine()
+
+        if not force and get_schema_version(bind) == SCHEMA_VERSION:
+            _db_initialized = True
+            return False
+
+        if not database_exists(bind.url):
+            create_database(bind.url)
+
+        SqlAlchemyModel.metadata.create_all(bind=bind)
+        create_missing_columns(bind)
+        create_missing_indexes(bind)
+        create_search_index(bind)
+
+        with bind.begin() as connection:
+            connection.execute(sqlalchemy.delete(schema_version_table))
+            connection.execute(
+                sqlalchemy.insert(schema_version_table).values(version=SCHEMA_VERSION)
+            )
+
+        _db_initialized = True
+        return True
@@ -0,0 +1,65 @@
+import functools
+import re
+import typing
+
+import pydantic
+
+EMAIL_MIN_LENGTH = 5
+PASSWORD_MIN_LENGTH = 8
+
+# Компилируется один раз при импорте, а не на каждый вызов re.match()
+EMAIL_PATTERN = re.compile(r'([A-Za-z0-9]+[.-_])*[A-Za-z0-9]+@[A-Za-z0-9-]+(\.[A-Z|a-z]{2,})+')
+
+
+def validate_email(value: str) -> str:
+    if len(value) < EMAIL_MIN_LENGTH:
+        raise ValueError(
+            f'Поле почты должно состоять не менее чем из {EMAIL_MIN_LENGTH} символов.'
+        )
+
+    elif not EMAIL_PATTERN.match(value):
+        raise ValueError(
+            'Неверный формат эл.почты.'
+        )
+
+    return value
+
+
+def validate_password(value: str) -> str:
+    if len(value) < PASSWORD_MIN_LENGTH:
+        raise ValueError(
+            f'Пароль должен состоять минимум из {PASSWORD_MIN_LENGTH} символов!'
+        )
+
+    return value
+
+
+def non_negative(message: str) -> pydantic.AfterValidator:
+    """
+    Валидатор целого числа не меньше нуля.
+    :param message: текст ошибки.
+    """
+
+    def validate(value: int) -> int:
+        if value < 0:
+            raise ValueError(message)
+
+        return value
+
+    return pydantic.AfterValidator(validate)
+
+
+Email = typing.Annotated[str, pydantic.AfterValidator(validate_email)]
+Password = typing.Annotated[str, pydantic.AfterValidator(validate_password)]
+Price = typing.Annotated[int, non_negative('Значение цены товара должно быть больше нуля.')]
+QuantityLeft = typing.Annotated[int, non_negative('Значение кол-во оставшегося товара должно быть больше нуля.')]
+
+
+@functools.cache
+def get_list_adapter(model: type[pydantic.BaseModel]) -> pydantic.TypeAdapter:
+    """
+    TypeAdapter для списка моделей. Схема валидации строится один раз
+    на модель, и весь список проверяется одним вызовом pydantic-core.
+    """
+
+    return pydantic.TypeAdapter(list[model])
@@ -1,8 +1,10 @@
 import typing
-from passwords import create_hash, validate_password
+from passwords import acreate_hash, avalidate_password, needs_rehash
 import flet as ft
+from sqlalchemy.exc import IntegrityError
 import controls
-from models import sqlalchemy, pydantic
+from models import sqlalchemy, pydantic, instrumentation
+from services import cart, checkout, throttling
 
 product = controls.Product(title='Товар 1', description='Описание товара', price=30000, quantity_left=12, id=1)
 product2 = controls.Product(
@@ -15,6 +17,9 @@ product2 = controls.Product(
 )
 
 
+ORDERS_PER_PAGE = 20
+
+
 def render_error(page: ft.Page, message: str):
     """
     Функция для отображения ошибки.
@@ -72,7 +77,6 @@ def render_warning(page: ft.Page, message: str):
 
 def Index(page: ft.Page, user_control: typing.Any):
     search_ref = ft.Ref()
-    products = sqlalchemy.Product.fetch_all(quantity_left__gt=0)
     column = ft.Column()
 
     authorized_user = user_control.get_user()
@@ -83,78 +87,101 @@ def Index(page: ft.Page, user_control: typing.Any):
 
         page.go('/profile')
 
-    def handle_buy_product_now(product_clicked):
-        print('buy now', product_clicked)
-
+    async def handle_buy_product_now(product_clicked):
         if not authorized_user:
             return page.go('/login')
 
-    def handle_add_product_to_cart(product_clicked):
+        await handle_add_product_to_cart(product_clicked)
+        await handle_open_shopping_cart(None)
+
+    async def handle_add_product_to_cart(product_clicked):
         if not authorized_user:
             return page.go('/login')
 
-        cart_item, is_created = sqlalchemy.CartItem.fetch_or_create(
+        _, user_cart_items_length = await cart.aadd_to_cart(
             user_id=authorized_user.id,
             product_id=product_clicked.id
         )
 
-        if not is_created:
-            sqlalchemy.CartItem.update(
-                row_id=cart_item.id,
-                quantity=cart_item.quantity + 1
-            )
-
-        user_cart_items_length = get_total_cart_items(
-            sqlalchemy.CartItem.fetch_all(
-                user_id=authorized_user.id
-            )
-        )
-
         cart_button.text = f'{user_cart_items_length}'
         page.update()
 
     def handle_product_card_click(product_clicked):
         print('product clicked: ', product_clicked)
 
+    def fetch_products_page(after: typing.Any, limit: int, **filters: typing.Any):
+        products, cursor = sqlalchemy.Product.fetch_page(
+            after=after,
+            limit=limit,
+            fast=True,
+            quantity_left__gt=0,
+            **filters
+        )
+
+        return pydantic.from_rows(pydantic.ProductModel, products), cursor
+
+    def search_products_page(search_string: str, after: typing.Any, limit: int):
+        products, cursor = sqlalchemy.Product.search(
+            search_string,
+            after=after,
+            limit=limit,
+            fast=True,
+            quantity_left__gt=0
+        )
+
+        return pydantic.from_rows(pydantic.ProductModel, products), cursor
+
+    @instrumentation.tracked
     def handle_search(ref: ft.Ref):
         search_string: str = ref.current.value
 
-        product_list.products = list(filter(
-            lambda product_iter: search_string.lower() in product_iter.title.lower(),
-            products
-        ))
+        if not search_string:
+            product_list.fetch_page = fetch_products_page
+            return
 
-    def handle_open_shopping_cart(_):
-        user_cart_items = sqlalchemy.CartItem.fetch_all(
-            user_id=authorized_user.id
-        )
+        product_list.fetch_page = lambda after, limit: search_products_page(search_string, after, limit)
+
+    @instrumentation.tracked
+    async def handle_open_shopping_cart(_):
+        user_cart_items = await cart.aget_cart_items(authorized_user.id)
 
+        @instrumentation.tracked
         def handle_quantity_change(cart_item: sqlalchemy.CartItem, number: int = 1):
             if cart_button:
                 cart_button.text = f"{int(cart_button.text) + number}"
                 page.update()
 
-            return sqlalchemy.CartItem.update(
-                row_id=cart_item.id,
-                quantity=cart_item.quantity + number
-            )
+            # Изменение на number в самом UPDATE, а не запись нового значения:
+            # кол-во в cart_item уже изменено виджетом, а корзина может
+            # одновременно меняться в другой вкладке.
+            return sqlalchemy.CartItem.add_to_field(cart_item.id, 'quantity', number, minimum=1)
 
+        @instrumentation.tracked
         def handle_cart_item_delete(cart_item: sqlalchemy.CartItem):
             return sqlalchemy.CartItem.delete(id=cart_item.id)
 
+        @instrumentation.tracked
+        def handle_checkout(_):
+            try:
+                checkout.checkout(user_id=authorized_user.id)
+            except checkout.CheckoutError as error:
+                page.close_end_drawer()
+                return render_error(page, str(error))
+
+            page.close_end_drawer()
+            page.go('/profile')
+
         drawer = controls.ShoppingCartCanvas(
             cart_items=user_cart_items,
             on_item_delete=handle_cart_item_delete,
             on_quantity_change=handle_quantity_change,
+            on_checkout=handle_checkout,
         )
 
         page.show_end_drawer(end_drawer=drawer)
 
-    def get_total_cart_items(items: list[sqlalchemy.CartItem]):
-        return sum([item.quantity for item in items])
-
     product_list = controls.ProductList(
-        products=products,
+        fetch_page=fetch_products_page,
         on_add_to_cart_click=handle_add_product_to_cart,
         on_buy_now_click=handle_buy_product_now,
         on_product_click=handle_product_card_click,
@@ -162,13 +189,12 @@ def Index(page: ft.Page, user_control: typing.Any):
     )
 
     if authorized_user:
-        cart_items = sqlalchemy.CartItem.fetch_all(user_id=authorized_user.id)
         cart_button = ft.Badge(
             content=ft.IconButton(
                 icon=ft.icons.SHOPPING_CART,
                 on_click=handle_open_shopping_cart,
             ),
-            text=f'{get_total_cart_items(cart_items)}',
+            text=f'{cart.get_cart_total(authorized_user.id)}',
         )
     else:
         cart_button = None
@@ -231,7 +257,7 @@ def Index(page: ft.Page, user_control: typing.Any):
         )
     )
 
-    if products and product_list.products:
+    if product_list.products:
         column.controls.append(product_list)
     else:
         column.controls.append(ft.Text('Ничего не найдено!!'))
@@ -248,25 +274,40 @@ def Login(page: ft.Page, user_control: typing.Any):
     if authorized_user:
         return page.go('/')
 
-    def handle_form_submit(data: dict):
+    async def handle_form_submit(data: dict):
         email = data.get('email')
         password = data.get('password')
 
-        user = sqlalchemy.User.fetch_one(email=email)
+        if not throttling.login_throttler.allow(email, page.client_ip or page.session_id):
+            return render_error(
+                page=page,
+                message='Слишком много попыток входа. Попробуйте позже.'
+            )
+
+        user = await sqlalchemy.User.afetch_one(email=email)
         if not user:
             return render_error(
                 page=page,
                 message='Данный пользователь еще не зарегистрирован.'
             )
 
-        password_is_valid = validate_password(password, user.password_hash)
+        password_is_valid = await avalidate_password(password, user.password_hash)
         if not password_is_valid:
             return render_error(
                 page=page,
                 message='Неверные данные для входа.'
             )
 
-        user_control.set_user(user)
+        # Хэши старого формата или с устаревшими параметрами пересчитываются,
+        # пока пароль известен
+        if needs_rehash(user.password_hash):
+            user = await sqlalchemy.User.aupdate(
+                user.id,
+                password_hash=await acreate_hash(password)
+            )
+
+        throttling.login_throttler.reset(email)
+        await user_control.login(user)
         page.go('/')
 
     def handle_registration_button_click(_):
@@ -304,18 +345,25 @@ def Registration(page: ft.Page, user_control: typing.Any):
     if authorized_user:
         return page.go('/')
 
-    def handle_form_submit(data: dict):
+    async def handle_form_submit(data: dict):
         password = data.pop('password')
-        data['password_hash'] = create_hash(password)
-        user_exists = sqlalchemy.User.fetch_one(
+        user_exists = await sqlalchemy.User.aexists(
             email=data.get('email')
         )
 
         if user_exists:
             return render_error(page, 'Данный пользователь уже зарегистрирован!')
 
-        user = sqlalchemy.User.create(**data)
-        user_control.set_user(user)
+        data['password_hash'] = await acreate_hash(password)
+
+        try:
+            user = await sqlalchemy.User.acreate(**data)
+        except IntegrityError:
+            # Та же почта зарегистрирована одновременно с проверкой выше
+            # (уникальный индекс ux_users_email)
+            return render_error(page, 'Данный пользователь уже зарегистрирован!')
+
+        await user_control.login(user)
         page.go('/')
 
     def handle_login_button_click(_):
@@ -361,8 +409,6 @@ def Profile(page: ft.Page, user_control: typing.Any):
         submit_button_text='Изменить'
     )
 
-    orders = sqlalchemy.Order.fetch_all(user_id=authorized_user.id)
-
     def handle_logout_dialog_confirm(_):
         page.dialog.open = False
         user_control.logout()
@@ -394,16 +440,36 @@ def Profile(page: ft.Page, user_control: typing.Any):
         submit_button_text='Создать'
     )
 
-    order_cards = [
-        controls.OrderCard(
-            order=order,
-            order_items=sqlalchemy.OrderItem.fetch_all(order_id=order.id)
-        ) for order in orders
-    ]
+    orders_cursor = None
+
+    def load_orders_page():
+        nonlocal orders_cursor
+
+        orders, orders_cursor = sqlalchemy.Order.fetch_history(
+            authorized_user.id,
+            after=orders_cursor,
+            limit=ORDERS_PER_PAGE,
+        )
+
+        orders_menu_content.controls[-1:-1] = [
+            controls.OrderCard(
+                order=order,
+                order_items=order.order_items,
+                total_quantity=order.total_quantity,
+            ) for order in orders
+        ]
+        load_more_orders_button.visible = orders_cursor is not None
+
+    @instrumentation.tracked
+    def handle_load_more_orders(_):
+        load_orders_page()
+        page.update()
 
+    load_more_orders_button = ft.ElevatedButton('Загрузить еще', on_click=handle_load_more_orders)
     orders_menu_content = ft.Column(
-        controls=order_cards,
+        controls=[load_more_orders_button],
     )
+    load_orders_page()
 
     def show_logout_dialog():
         page.dialog = logout_dialog
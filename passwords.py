@@ -1,19 +1,213 @@
+import abc
+import asyncio
+import base64
+import concurrent.futures
+import hashlib
 import hmac
+import os
+import threading
 from hashlib import sha256
+import settings
 
 
 ENCODING = 'utf-8'
 DIGEST_MODE = sha256
 SECRET = 'secret'
 
+# Разделитель частей хэша: алгоритм$параметры$соль$хэш
+SEPARATOR = '$'
 
-def create_hash(password: str):
-    password = password.encode(ENCODING)
-    secret = SECRET.encode(ENCODING)
-    return hmac.new(key=secret, msg=password, digestmod=DIGEST_MODE).hexdigest()
 
+def encode_bytes(value: bytes) -> str:
+    return base64.b64encode(value).decode('ascii')
 
-def validate_password(password: str, password_hash: str):
-    test_hash = create_hash(password)
-    return hmac.compare_digest(test_hash, password_hash)
 
+def decode_bytes(value: str) -> bytes:
+    return base64.b64decode(value.encode('ascii'))
+
+
+class Hasher(abc.ABC):
+    """
+    Базовый алгоритм хэширования паролей.
+    Хэш хранится вместе с алгоритмом, параметрами и солью, поэтому
+    параметры можно менять, не ломая проверку уже сохраненных паролей.
+    """
+
+    algorithm: str = None
+
+    @abc.abstractmethod
+    def get_parameters(self) -> str:
+        """
+        Параметры алгоритма в виде строки, сохраняемой в хэше.
+        """
+
+    @abc.abstractmethod
+    def derive(self, password: bytes, salt: bytes, parameters: str) -> bytes:
+        """
+        Вычисление хэша пароля с солью и параметрами из get_parameters().
+        """
+
+    def encode(self, password: str, salt: bytes = None) -> str:
+        salt = salt or os.urandom(settings.PASSWORD_SALT_SIZE)
+        parameters = self.get_parameters()
+        digest = self.derive(password.encode(ENCODING), salt, parameters)
+
+        return SEPARATOR.join([self.algorithm, parameters, encode_bytes(salt), encode_bytes(digest)])
+
+    def verify(self, password: str, password_hash: str) -> bool:
+        _, parameters, salt, digest = password_hash.split(SEPARATOR)
+        test_digest = self.derive(password.encode(ENCODING), decode_bytes(salt), parameters)
+
+        return hmac.compare_digest(test_digest, decode_bytes(digest))
+
+    def needs_rehash(self, password_hash: str) -> bool:
+        return password_hash.split(SEPARATOR)[1] != self.get_parameters()
+
+
+class ScryptHasher(Hasher):
+    """
+    scrypt: требует n * r * 128 байт памяти на вычисление,
+    что делает перебор на GPU/ASIC дорогим.
+    """
+
+    algorithm = 'scrypt'
+
+    def __init__(self, n: int = None, r: int = None, p: int = None):
+        self.n = n or settings.PASSWORD_SCRYPT_N
+        self.r = r or settings.PASSWORD_SCRYPT_R
+        self.p = p or settings.PASSWORD_SCRYPT_P
+
+    def get_parameters(self) -> str:
+        return f'n={self.n},r={self.r},p={self.p}'
+
+    def derive(self, password: bytes, salt: bytes, parameters: str) -> bytes:
+        values = dict(item.split('=') for item in parameters.split(','))
+        n, r, p = int(values['n']), int(values['r']), int(values['p'])
+
+        return hashlib.scrypt(
+            password,
+            salt=salt,
+            n=n,
+            r=r,
+            p=p,
+            # Запас сверх 128 * n * r, иначе OpenSSL отклоняет большие n
+            maxmem=256 * n * r * p,
+            dklen=32,
+        )
+
+
+class PBKDF2Hasher(Hasher):
+    """
+    PBKDF2-HMAC-SHA256, для окружений без scrypt в OpenSSL.
+    """
+
+    algorithm = 'pbkdf2_sha256'
+
+    def __init__(self, iterations: int = None):
+        self.iterations = iterations or settings.PASSWORD_PBKDF2_ITERATIONS
+
+    def get_parameters(self) -> str:
+        return str(self.iterations)
+
+    def derive(self, password: bytes, salt: bytes, parameters: str) -> bytes:
+        return hashlib.pbkdf2_hmac('sha256', password, salt, int(parameters))
+
+
+class LegacyHmacHasher(Hasher):
+    """
+    Прежний формат: HMAC-SHA256 с общим SECRET, без соли.
+    Только проверка, при входе такие хэши заменяются (см. needs_rehash()).
+    """
+
+    algorithm = 'hmac_sha256'
+
+    def get_parameters(self) -> str:
+        return ''
+
+    def derive(self, password: bytes, salt: bytes, parameters: str) -> bytes:
+        return hmac.new(key=SECRET.encode(ENCODING), msg=password, digestmod=DIGEST_MODE).digest()
+
+    def encode(self, password: str, salt: bytes = None) -> str:
+        return self.derive(password.encode(ENCODING), b'', '').hex()
+
+    def verify(self, password: str, password_hash: str) -> bool:
+        return hmac.compare_digest(self.encode(password), password_hash)
+
+    def needs_rehash(self, password_hash: str) -> bool:
+        return True
+
+
+HASHERS = {
+    hasher.algorithm: hasher
+    for hasher in [ScryptHasher, PBKDF2Hasher, LegacyHmacHasher]
+}
+
+
+def get_hasher(password_hash: str = None) -> Hasher:
+    """
+    Алгоритм, которым создан хэш, либо алгоритм по умолчанию (settings.PASSWORD_HASHER).
+    """
+
+    if password_hash is None:
+        return HASHERS[settings.PASSWORD_HASHER]()
+
+    if SEPARATOR not in password_hash:
+        return LegacyHmacHasher()
+
+    algorithm = password_hash.split(SEPARATOR, 1)[0]
+    if algorithm not in HASHERS:
+        raise RuntimeError(
+            f'Неизвестный алгоритм хэширования пароля: {algorithm}'
+        )
+
+    return HASHERS[algorithm]()
+
+
+def create_hash(password: str) -> str:
+    return get_hasher().encode(password)
+
+
+def validate_password(password: str, password_hash: str) -> bool:
+    return get_hasher(password_hash).verify(password, password_hash)
+
+
+def needs_rehash(password_hash: str) -> bool:
+    """
+    Нужно ли пересчитать хэш: он создан другим алгоритмом или с другими параметрами.
+    """
+
+    hasher = get_hasher(password_hash)
+    return type(hasher) is not HASHERS[settings.PASSWORD_HASHER] or hasher.needs_rehash(password_hash)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> concurrent.futures.ThreadPoolExecutor:
+    """
+    Пул потоков хэширования. scrypt и PBKDF2 отпускают GIL, а размер пула
+    ограничивает кол-во одновременных вычислений (и память scrypt).
+    """
+
+    global _executor
+
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=settings.PASSWORD_HASHING_WORKERS,
+                    thread_name_prefix='password-hashing',
+                )
+
+    return _executor
+
+
+async def acreate_hash(password: str) -> str:
+    return await asyncio.get_running_loop().run_in_executor(get_executor(), create_hash, password)
+
+
+async def avalidate_password(password: str, password_hash: str) -> bool:
+    return await asyncio.get_running_loop().run_in_executor(
+        get_executor(), validate_password, password, password_hash
+    )
@@ -2,11 +2,21 @@ import flet as ft
 
 import models.sqlalchemy
 import pages
+from models import instrumentation
+from services.sessions import session_store, CLIENT_STORAGE_KEY
 
 
 class UserControl:
-    def __init__(self):
+    """
+    Авторизованный пользователь сессии Flet.
+    Токен сессии хранится в page.client_storage, поэтому пользователь
+    остается авторизованным после переподключения и в новых вкладках.
+    """
+
+    def __init__(self, page: ft.Page = None):
+        self.page = page
         self.authorized_user = None
+        self.session_token = None
 
     def get_user(self):
         return self.authorized_user
@@ -14,13 +24,51 @@ class UserControl:
     def set_user(self, value: models.sqlalchemy.User):
         self.authorized_user = value
 
+    def restore(self):
+        """
+        Восстанавливает пользователя по токену из client_storage.
+        Вызывается из синхронного кода: синхронные методы client_storage
+        ожидают ответа клиента и заблокировали бы цикл событий.
+        """
+
+        if not self.page:
+            return None
+
+        token = self.page.client_storage.get(CLIENT_STORAGE_KEY)
+        user = session_store.get_user(token) if token else None
+
+        if user:
+            self.session_token = token
+            self.set_user(user)
+
+        return user
+
+    async def login(self, value: models.sqlalchemy.User):
+        """
+        Авторизует пользователя и сохраняет токен новой сессии на клиенте.
+        """
+
+        self.set_user(value)
+        self.session_token = session_store.issue(value)
+
+        if self.page:
+            await self.page.client_storage.set_async(CLIENT_STORAGE_KEY, self.session_token)
+
     def logout(self):
         self.authorized_user = None
 
+        if self.session_token:
+            session_store.revoke(self.session_token)
+            self.session_token = None
+
+        if self.page:
+            self.page.client_storage.remove(CLIENT_STORAGE_KEY)
+
 
 class Router:
     def __init__(self, page: ft.Page, initial_route: str = '/'):
-        self.user_control = UserControl()
+        self.user_control = UserControl(page)
+        self.user_control.restore()
 
         self.routes = {
             '/': lambda: pages.Index(page, self.user_control),
@@ -29,11 +77,16 @@ class Router:
             '/profile': lambda: pages.Profile(page, self.user_control)
         }
         self.page = page
-        self.body = ft.Container(content=self.routes[initial_route]())
+        self.body = ft.Container(content=self.render(initial_route))
+
+    def render(self, route: str):
+        # Запросы, выполненные при построении страницы, учитываются по маршруту
+        with instrumentation.track(f'route {route}'):
+            return self.routes[route]()
 
     def handle_route_change(self, route):
         self.body.clean()
-        new_content = self.routes[route.route]()
+        new_content = self.render(route.route)
         if not new_content:
             return
 
@@ -0,0 +1,78 @@
+from models import sqlalchemy
+from models.database import session_scope, async_session_scope
+
+
+def get_cart_total(user_id: int) -> int:
+    """
+    Общее кол-во товаров в корзине пользователя.
+    :param user_id: id пользователя.
+    :return: сумма quantity по строкам корзины.
+    """
+
+    return sqlalchemy.CartItem.sum('quantity', user_id=user_id)
+
+
+def add_to_cart(user_id: int, product_id: int, quantity: int = 1) -> [sqlalchemy.CartItem, int]:
+    """
+    Добавление товара в корзину одним запросом INSERT ... ON CONFLICT DO UPDATE.
+    :param user_id: id пользователя.
+    :param product_id: id товара.
+    :param quantity: кол-во добавляемого товара.
+    :return: строка корзины и новое общее кол-во товаров в корзине
+        (подсчитанное в той же транзакции).
+    """
+
+    with session_scope():
+        cart_item = sqlalchemy.CartItem.increment(
+            ['user_id', 'product_id'],
+            'quantity',
+            quantity,
+            user_id=user_id,
+            product_id=product_id,
+        )
+
+        return cart_item, get_cart_total(user_id)
+
+
+async def aget_cart_total(user_id: int) -> int:
+    """
+    Асинхронная версия get_cart_total().
+    """
+
+    return await sqlalchemy.CartItem.asum('quantity', user_id=user_id)
+
+
+async def aadd_to_cart(user_id: int, product_id: int, quantity: int = 1) -> [sqlalchemy.CartItem, int]:
+    """
+    Асинхронная версия add_to_cart().
+    """
+
+    async with async_session_scope():
+        cart_item = await sqlalchemy.CartItem.aincrement(
+            ['user_id', 'product_id'],
+            'quantity',
+            quantity,
+            user_id=user_id,
+            product_id=product_id,
+        )
+
+        return cart_item, await aget_cart_total(user_id)
+
+
+async def aget_cart_items(user_id: int) -> list[sqlalchemy.CartItem]:
+    """
+    Строки корзины пользователя с товарами (item.product).
+    Товары берутся из кэша товаров, из БД догружаются только отсутствующие в нем.
+    :param user_id: id пользователя.
+    :return: строки корзины.
+    """
+
+    cart_items = await sqlalchemy.CartItem.afetch_all(user_id=user_id)
+    products = await sqlalchemy.Product.afetch_many_by_ids(
+        [cart_item.product_id for cart_item in cart_items]
+    )
+
+    for cart_item in cart_items:
+        cart_item.product = products.get(cart_item.product_id)
+
+    return cart_items
@@ -0,0 +1,90 @@
+import sqlalchemy as sa
+from models import sqlalchemy
+from models.database import session_scope
+
+
+class CheckoutError(RuntimeError):
+    """
+    Ошибка оформления заказа (пустая корзина, нехватка товара на складе)
+    """
+
+
+def checkout(user_id: int, delivery_address: str = None) -> sqlalchemy.Order:
+    """
+    Оформление заказа из корзины пользователя одной транзакцией.
+
+    Все шаги выполняются на стороне СУБД фиксированным числом запросов
+    независимо от размера корзины:
+    списание остатков товаров (только при quantity_left >= кол-ва в корзине),
+    создание заказа с суммой, посчитанной в SQL, перенос строк корзины
+    в OrderItem (INSERT ... SELECT) и очистка корзины.
+    При нехватке хотя бы одного товара транзакция откатывается целиком.
+    :param user_id: id пользователя.
+    :param delivery_address: адрес доставки (по умолчанию - значение модели Order).
+    :return: созданный заказ.
+    """
+
+    products = sqlalchemy.Product.__mapper__.columns
+    cart_items = sqlalchemy.CartItem.__mapper__.columns
+
+    user_cart = sa.select(cart_items.product_id, cart_items.quantity).where(
+        cart_items.user_id == user_id
+    ).subquery()
+    cart_quantity = sa.select(user_cart.c.quantity).where(
+        user_cart.c.product_id == products.id
+    ).scalar_subquery()
+
+    with session_scope() as session:
+        # UPDATE выполняется первым, чтобы транзакция сразу получила
+        # блокировку на запись и корзина не изменилась до ее очистки
+        updated_products = session.execute(
+            sa.update(sqlalchemy.Product.__table__).where(
+                products.id.in_(sa.select(user_cart.c.product_id)),
+                products.quantity_left >= cart_quantity,
+            ).values({
+                products.quantity_left: products.quantity_left - cart_quantity
+            })
+        ).rowcount
+
+        cart_size = sqlalchemy.CartItem.count(user_id=user_id)
+        if not cart_size:
+            raise CheckoutError('Корзина пуста.')
+
+        if updated_products != cart_size:
+            raise CheckoutError('Недостаточно товара на складе для оформления заказа.')
+
+        order_values = {
+            'user_id': user_id,
+            'total_price': sa.select(
+                sa.func.coalesce(sa.func.sum(cart_items.quantity * products.price), 0)
+            ).select_from(
+                sqlalchemy.CartItem.__table__.join(
+                    sqlalchemy.Product.__table__,
+                    products.id == cart_items.product_id
+                )
+            ).where(
+                cart_items.user_id == user_id
+            ).scalar_subquery(),
+        }
+
+        if delivery_address:
+            order_values['delivery_address'] = delivery_address
+
+        order = sqlalchemy.Order.execute_returning(
+            sa.insert(sqlalchemy.Order).values(**order_values)
+        )
+
+        session.execute(
+            sa.insert(sqlalchemy.OrderItem.__table__).from_select(
+                ['order_id', 'product_id', 'quantity'],
+                sa.select(
+                    sa.literal(order.id),
+                    cart_items.product_id,
+                    cart_items.quantity,
+                ).where(cart_items.user_id == user_id)
+            )
+        )
+
+        sqlalchemy.CartItem.delete(user_id=user_id)
+
+    return order
@@ -0,0 +1,115 @@
+import hashlib
+import hmac
+import secrets
+import time
+import typing
+import settings
+from models import sqlalchemy
+
+# Ключ токена в page.client_storage
+CLIENT_STORAGE_KEY = 'fletwb.session'
+
+SEPARATOR = '.'
+
+
+class SessionStore:
+    """
+    Подписанные токены сессий:
+    "id пользователя.id сессии.версия сессий.срок действия.подпись".
+
+    Токен проверяется по подписи HMAC, сроку действия и версии сессий
+    пользователя (User.session_version). Запись пользователя берется из кэша
+    User.result_cache, поэтому проверка обычно не обращается к БД. Выход
+    увеличивает версию в БД и отзывает все токены пользователя, в том числе
+    после перезапуска; другие процессы видят отзыв не позже чем через
+    settings.USER_CACHE_TTL.
+    """
+
+    def __init__(self, secret: str = None, ttl: float = None):
+        self.__secret = (secret or settings.SESSION_SECRET).encode('utf-8')
+        self.__ttl = ttl or settings.SESSION_TTL
+
+        self.issued = 0
+        self.rejected = 0
+        self.revoked = 0
+
+    def sign(self, payload: str) -> str:
+        return hmac.new(self.__secret, payload.encode('utf-8'), hashlib.sha256).hexdigest()
+
+    def issue(self, user: sqlalchemy.User) -> str:
+        """
+        Новый токен сессии пользователя.
+        :param user: запись пользователя (нужны id и session_version).
+        """
+
+        payload = SEPARATOR.join([
+            str(user.id),
+            secrets.token_hex(16),
+            str(user.session_version or 0),
+            str(int(time.time() + self.__ttl)),
+        ])
+        self.issued += 1
+
+        return SEPARATOR.join([payload, self.sign(payload)])
+
+    def parse(self, token: str) -> typing.Optional[tuple[int, str, int, int]]:
+        """
+        Проверяет подпись и срок действия токена (без обращения к БД).
+        :return: id пользователя, id сессии, версия сессий и срок действия,
+            либо None, если токен поврежден, подделан или просрочен.
+        """
+
+        parts = (token or '').split(SEPARATOR)
+
+        if len(parts) != 5 or not hmac.compare_digest(self.sign(SEPARATOR.join(parts[:4])), parts[4]):
+            self.rejected += 1
+            return None
+
+        user_id, session_id, version, expires_at = int(parts[0]), parts[1], int(parts[2]), int(parts[3])
+
+        if expires_at <= time.time():
+            self.rejected += 1
+            return None
+
+        return user_id, session_id, version, expires_at
+
+    def revoke(self, token: str) -> None:
+        """
+        Отзывает все сессии пользователя токена увеличением его версии сессий.
+        """
+
+        parsed = self.parse(token)
+        if parsed is None:
+            return
+
+        sqlalchemy.User.add_to_field(parsed[0], 'session_version', 1)
+        self.revoked += 1
+
+    def get_user(self, token: str) -> typing.Optional[sqlalchemy.User]:
+        """
+        Пользователь сессии токена, либо None, если токен недействителен
+        или его сессия отозвана.
+        """
+
+        parsed = self.parse(token)
+        if parsed is None:
+            return None
+
+        user = sqlalchemy.User.fetch_one(id=parsed[0])
+
+        if user is None or user.session_version != parsed[2]:
+            self.rejected += 1
+            return None
+
+        return user
+
+    def stats(self) -> dict[str, int]:
+        return {
+            'issued': self.issued,
+            'rejected': self.rejected,
+            'revoked': self.revoked,
+            'users': sqlalchemy.User.result_cache.stats(),
+        }
+
+
+session_store = SessionStore()
@@ -0,0 +1,147 @@
+import collections
+import threading
+import time
+import typing
+import settings
+
+
+class TokenBucketLimiter:
+    """
+    Ограничитель частоты по ключу (token bucket).
+
+    У каждого ключа есть корзина на capacity попыток, пополняемая на одну
+    попытку каждые refill_seconds. Состояние ключа - пара (попытки, время
+    обновления) в OrderedDict: проверка выполняется за O(1), а при
+    превышении max_keys вытесняется давно не использованный ключ.
+    """
+
+    def __init__(self, capacity: int, refill_seconds: float, max_keys: int = None):
+        self.capacity = capacity
+        self.refill_seconds = refill_seconds
+        self.max_keys = max_keys or settings.LOGIN_THROTTLE_MAX_KEYS
+
+        self.__buckets = collections.OrderedDict()
+        self.__lock = threading.Lock()
+
+        self.allowed = 0
+        self.throttled = 0
+        self.evictions = 0
+
+    def get_tokens(self, key: typing.Hashable, now: float) -> float:
+        bucket = self.__buckets.get(key)
+        if bucket is None:
+            return self.capacity
+
+        tokens, updated_at = bucket
+        return min(self.capacity, tokens + (now - updated_at) / self.refill_seconds)
+
+    def peek(self, key: typing.Hashable) -> bool:
+        """
+        Есть ли у ключа попытка, без ее расходования.
+        """
+
+        with self.__lock:
+            return self.get_tokens(key, time.monotonic()) >= 1
+
+    def consume(self, key: typing.Hashable) -> bool:
+        """
+        Расходует попытку ключа.
+        :return: False, если попыток не осталось.
+        """
+
+        now = time.monotonic()
+
+        with self.__lock:
+            tokens = self.get_tokens(key, now)
+            allowed = tokens >= 1
+
+            self.__buckets[key] = (tokens - 1 if allowed else tokens, now)
+            self.__buckets.move_to_end(key)
+
+            if len(self.__buckets) > self.max_keys:
+                self.__buckets.popitem(last=False)
+                self.evictions += 1
+
+            if allowed:
+                self.allowed += 1
+            else:
+                self.throttled += 1
+
+            return allowed
+
+    def reset(self, key: typing.Hashable) -> None:
+        with self.__lock:
+            self.__buckets.pop(key, None)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            'keys': len(self.__buckets),
+            'allowed': self.allowed,
+            'throttled': self.throttled,
+            'evictions': self.evictions,
+        }
+
+
+class LoginThrottler:
+    """
+    Ограничение попыток входа по email и по клиенту (IP/сессии Flet).
+    Проверка выполняется до обращения к БД и вычисления хэша пароля.
+    """
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.by_email = TokenBucketLimiter(
+            settings.LOGIN_THROTTLE_EMAIL_CAPACITY,
+            settings.LOGIN_THROTTLE_EMAIL_REFILL_SECONDS,
+        )
+        self.by_client = TokenBucketLimiter(
+            settings.LOGIN_THROTTLE_CLIENT_CAPACITY,
+            settings.LOGIN_THROTTLE_CLIENT_REFILL_SECONDS,
+        )
+
+    @staticmethod
+    def normalize_email(email: str) -> str:
+        return (email or '').strip().lower()
+
+    def allow(self, email: str, client: str) -> bool:
+        """
+        Расходует попытку входа.
+        :param email: email, под которым выполняется вход.
+        :param client: идентификатор клиента.
+        :return: False, если попытки для email или клиента исчерпаны.
+        """
+
+        email = self.normalize_email(email)
+
+        with self.__lock:
+            email_allowed = self.by_email.peek(email)
+            client_allowed = self.by_client.peek(client)
+
+            # Попытка расходуется, только если ее разрешают оба ограничения,
+            # иначе перебор по одному email съедал бы попытки клиента и наоборот.
+            # Для исчерпанного ключа consume() только учитывает отказ и поднимает
+            # ключ в LRU, чтобы перебор других ключей не вытеснил его первым.
+            if not email_allowed:
+                self.by_email.consume(email)
+            if not client_allowed:
+                self.by_client.consume(client)
+            if not (email_allowed and client_allowed):
+                return False
+
+            return self.by_email.consume(email) and self.by_client.consume(client)
+
+    def reset(self, email: str) -> None:
+        """
+        Сбрасывает ограничение email после успешного входа.
+        """
+
+        self.by_email.reset(self.normalize_email(email))
+
+    def stats(self) -> dict[str, dict[str, int]]:
+        return {
+            'email': self.by_email.stats(),
+            'client': self.by_client.stats(),
+        }
+
+
+login_throttler = LoginThrottler()
@@ -1,6 +1,57 @@
 import os
+import secrets
 
-DATABASE_URL = 'sqlite:///metanit.db'
+DATABASE_URL = os.environ.get('DATABASE_URL', 'sqlite:///metanit.db')
+
+# Параметры пула соединений
+DATABASE_POOL_SIZE = int(os.environ.get('DATABASE_POOL_SIZE', 10))
+DATABASE_MAX_OVERFLOW = int(os.environ.get('DATABASE_MAX_OVERFLOW', 20))
+DATABASE_POOL_TIMEOUT = int(os.environ.get('DATABASE_POOL_TIMEOUT', 30))
+DATABASE_POOL_RECYCLE = int(os.environ.get('DATABASE_POOL_RECYCLE', 1800))
+
+# PRAGMA, применяемые к каждому новому соединению SQLite
+SQLITE_PRAGMAS = {
+    'journal_mode': os.environ.get('SQLITE_JOURNAL_MODE', 'WAL'),
+    'synchronous': os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL'),
+    'cache_size': int(os.environ.get('SQLITE_CACHE_SIZE', -64000)),
+    'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+    'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000)),
+    'foreign_keys': os.environ.get('SQLITE_FOREIGN_KEYS', 'ON'),
+}
+
+# Кэш товаров: кол-во хранимых выборок и время жизни записи в секундах
+PRODUCT_CACHE_SIZE = int(os.environ.get('PRODUCT_CACHE_SIZE', 1024))
+PRODUCT_CACHE_TTL = float(os.environ.get('PRODUCT_CACHE_TTL', 60))
+
+# Учет запросов по маршрутам/обработчикам и порог журнала медленных запросов, мс
+QUERY_INSTRUMENTATION = os.environ.get('QUERY_INSTRUMENTATION', '1') == '1'
+SLOW_QUERY_THRESHOLD_MS = float(os.environ.get('SLOW_QUERY_THRESHOLD_MS', 100))
+
+# Хэширование паролей: алгоритм (scrypt, pbkdf2_sha256), его параметры
+# (подбираются python -m benchmarks.passwords) и размер пула потоков
+PASSWORD_HASHER = os.environ.get('PASSWORD_HASHER', 'scrypt')
+PASSWORD_SCRYPT_N = int(os.environ.get('PASSWORD_SCRYPT_N', 2 ** 14))
+PASSWORD_SCRYPT_R = int(os.environ.get('PASSWORD_SCRYPT_R', 8))
+PASSWORD_SCRYPT_P = int(os.environ.get('PASSWORD_SCRYPT_P', 1))
+PASSWORD_PBKDF2_ITERATIONS = int(os.environ.get('PASSWORD_PBKDF2_ITERATIONS', 600_000))
+PASSWORD_SALT_SIZE = 16
+PASSWORD_HASHING_WORKERS = int(os.environ.get('PASSWORD_HASHING_WORKERS', 2))
+
+# Ограничение попыток входа: попыток подряд и секунд на восстановление одной попытки
+LOGIN_THROTTLE_EMAIL_CAPACITY = int(os.environ.get('LOGIN_THROTTLE_EMAIL_CAPACITY', 5))
+LOGIN_THROTTLE_EMAIL_REFILL_SECONDS = float(os.environ.get('LOGIN_THROTTLE_EMAIL_REFILL_SECONDS', 60))
+LOGIN_THROTTLE_CLIENT_CAPACITY = int(os.environ.get('LOGIN_THROTTLE_CLIENT_CAPACITY', 20))
+LOGIN_THROTTLE_CLIENT_REFILL_SECONDS = float(os.environ.get('LOGIN_THROTTLE_CLIENT_REFILL_SECONDS', 6))
+LOGIN_THROTTLE_MAX_KEYS = int(os.environ.get('LOGIN_THROTTLE_MAX_KEYS', 100_000))
+
+# Сессии: ключ подписи токенов (без SESSION_SECRET токены действуют только
+# до перезапуска процесса) и срок их действия в секундах
+SESSION_SECRET = os.environ.get('SESSION_SECRET') or secrets.token_hex(32)
+SESSION_TTL = int(os.environ.get('SESSION_TTL', 30 * 24 * 60 * 60))
+
+# Кэш пользователей для восстановления сессий
+USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 10_000))
+USER_CACHE_TTL = float(os.environ.get('USER_CACHE_TTL', 300))
 
 BASE_DIR = os.path.dirname(__file__)
 MEDIA_DIR = os.path.join(BASE_DIR, 'media')